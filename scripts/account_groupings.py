@@ -0,0 +1,71 @@
+#######################
+## Account Groupings ##
+#######################
+
+## Import packages
+import json
+import os
+import re
+
+## The rules live in account_groupings.json next to this file (override with ACCOUNT_GROUPINGS_PATH), so next year's
+## labels are a config edit rather than a code change. Both the backend and the Dash app read them from here.
+ACCOUNT_GROUPINGS_PATH = os.getenv('ACCOUNT_GROUPINGS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'account_groupings.json'))
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to load the grouping rules, compiling each group's patterns into a single case-insensitive regex
+def load_rules(path=ACCOUNT_GROUPINGS_PATH):
+    with open(path) as f:
+        config = json.load(f)
+    rules = [(group['name'], re.compile('|'.join(f"(?:{pattern})" for pattern in group['patterns']), re.IGNORECASE)) for group in config['groups']]
+    allowed_overlaps = [frozenset(overlap) for overlap in config.get('allowed_overlaps', [])]
+    return rules, allowed_overlaps
+
+## Function to get the group names, in the order they should be shown
+def group_names(path=ACCOUNT_GROUPINGS_PATH):
+    rules, _ = load_rules(path)
+    return [group_name for group_name, _ in rules]
+
+## Accounts classified against the rules in a single pass, indexed by id
+class AccountIndex:
+
+    def __init__(self, accounts, rules, allowed_overlaps=()):
+        self.accounts_by_id = {}
+        self.groups_by_id = {}
+        self.groups = {group_name: [] for group_name, _ in rules}
+        for account in accounts:
+            self.accounts_by_id[account['id']] = account
+            matched = [group_name for group_name, pattern in rules if pattern.search(account['name'])]
+            self.groups_by_id[account['id']] = matched
+            for group_name in matched:
+                self.groups[group_name].append(account['id'])
+
+        ## Accounts no rule picked up, and accounts in more than one group that the config doesn't expect
+        self.unmatched = [account_id for account_id, matched in self.groups_by_id.items() if not matched]
+        self.overlapping = [
+            account_id for account_id, matched in self.groups_by_id.items()
+            if len(matched) > 1 and not any(set(matched) <= overlap for overlap in allowed_overlaps)
+        ]
+
+    ## Name of an account
+    def name(self, account_id):
+        return self.accounts_by_id[account_id]['name']
+
+    ## Every account id that's in at least one group, each once, in group order
+    def grouped_account_ids(self):
+        return list(dict.fromkeys(account_id for account_ids in self.groups.values() for account_id in account_ids))
+
+    ## Print anything that looks off about the groupings
+    def report(self):
+        for account_id in self.overlapping:
+            print(f"Warning: {self.name(account_id)} is in more than one group: {', '.join(self.groups_by_id[account_id])}.")
+        if self.unmatched:
+            print(f"{len(self.unmatched)} accounts aren't in any group: {', '.join(sorted(self.name(account_id) for account_id in self.unmatched))}.")
+
+## Function to classify a list of accounts (as returned by the accounts endpoint) using the rules in the config file
+def classify_accounts(accounts, path=ACCOUNT_GROUPINGS_PATH):
+    rules, allowed_overlaps = load_rules(path)
+    return AccountIndex(accounts, rules, allowed_overlaps)
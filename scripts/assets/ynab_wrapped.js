@@ -0,0 +1,81 @@
+// Clientside callbacks for ynab_wrapped.py. The server sends figures and callout text with the numbers showing, and the
+// Hide Numbers toggle masks them here, so flipping it never makes a round trip.
+
+const HIDDEN = '$•••';
+
+// Whether an axis shows dollars - the year and label axes are left as they are
+function isDollarAxis(axis) {
+    return axis.tickprefix === '$' || (typeof axis.tickformat === 'string' && axis.tickformat.charAt(0) === '$');
+}
+
+// Copy of a figure with its hovertext and dollar tick labels masked (the values still scale the chart)
+function maskFigure(figure) {
+    const masked = JSON.parse(JSON.stringify(figure));
+    masked.data.forEach(function (trace) {
+        if (Array.isArray(trace.text)) {
+            trace.text = trace.text.map(function () { return HIDDEN; });
+        }
+    });
+    ['xaxis', 'yaxis'].forEach(function (axisName) {
+        const axis = masked.layout && masked.layout[axisName];
+        if (!axis || !isDollarAxis(axis)) {
+            return;
+        }
+        if (Array.isArray(axis.ticktext)) {
+            axis.ticktext = axis.ticktext.map(function () { return HIDDEN; });
+        } else {
+            axis.showticklabels = false;  // Dollar axes with automatic ticks just lose their labels
+        }
+    });
+    return masked;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ynab_wrapped: {
+
+        // figures is {balance, changes} from update_charts
+        render_charts: function (figures, hideNumbers) {
+            if (!figures) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            if (!hideNumbers) {
+                return [figures.balance, figures.changes];
+            }
+            return [maskFigure(figures.balance), maskFigure(figures.changes)];
+        },
+
+        // values is a list of [shown, hidden] pairs, one per callout box
+        render_callouts: function (values, hideNumbers) {
+            if (!values) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return values.map(function (pair) { return pair[hideNumbers ? 1 : 0]; });
+        },
+
+        // drilldown is {title, rows, page_count} from update_drilldown
+        render_drilldown: function (drilldown, hideNumbers) {
+            if (!drilldown) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            const rows = !hideNumbers ? drilldown.rows : drilldown.rows.map(function (row) {
+                return Object.assign({}, row, {amount: HIDDEN});
+            });
+            return [rows, drilldown.page_count, drilldown.title];
+        },
+
+        // insights is {figures, largest_transactions} from update_wrapped
+        render_wrapped: function (insights, hideNumbers) {
+            if (!insights) {
+                return Array(5).fill(window.dash_clientside.no_update);
+            }
+            const keys = ['top_categories', 'top_payees', 'monthly_spend', 'category_deltas'];
+            const figures = keys.map(function (key) {
+                return hideNumbers ? maskFigure(insights.figures[key]) : insights.figures[key];
+            });
+            const rows = !hideNumbers ? insights.largest_transactions : insights.largest_transactions.map(function (row) {
+                return Object.assign({}, row, {amount: HIDDEN});
+            });
+            return figures.concat([rows]);
+        }
+    }
+});
@@ -0,0 +1,104 @@
+###############
+## Benchmark ##
+###############
+
+## Measures the memory the app's account balances take and how long its selections take, on a synthetic budget of 10k
+## accounts over 20 years. Compares the long pandas frame the app used to hold (as read, with string columns, and with
+## categorical ones) against the AccountBalances table it holds now, for the selections its callbacks make - one
+## account type, several types, a type narrowed to some account names, and the account name dropdown.
+## Run with: python scripts/benchmark_aggregations.py --accounts 10000 --years 20
+
+## Import packages
+import argparse
+import statistics
+import time
+import numpy as np
+import pandas as pd
+import ynab_aggregations
+
+## Set vars
+ACCOUNT_TYPES = ['Cash', 'Registered', 'Non-Registered', 'Registered Gains', 'Credit Cards', 'Mortgage', 'Loans', 'Home Value']
+VALUE_COLUMNS = ['end_of_year_balance', 'number_of_transactions', 'change_in_balance']
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to build a synthetic long account_balances frame, one row per account and year, dollars in cents
+def synthetic_balances(n_accounts, n_years, seed=0):
+    rng = np.random.default_rng(seed)
+    account_types = np.array(ACCOUNT_TYPES, dtype=object)[rng.integers(0, len(ACCOUNT_TYPES), n_accounts)]
+    account_names = np.array([f'Account {number}' for number in range(n_accounts)], dtype=object)
+    return pd.DataFrame({
+        'account_type': np.repeat(account_types, n_years),
+        'account_name': np.repeat(account_names, n_years),
+        'year': np.tile(np.arange(2026 - n_years + 1, 2027), n_accounts),
+        'end_of_year_balance': rng.integers(-10_000_000, 10_000_000, n_accounts * n_years) / 100,
+        'number_of_transactions': rng.integers(0, 500, n_accounts * n_years),
+        'change_in_balance': rng.integers(-1_000_000, 1_000_000, n_accounts * n_years) / 100,
+    })
+
+## The frame-based selections the app used to make - a boolean mask over every row, then a groupby
+def frame_year_totals(df_account_balances, account_types, account_names):
+    selected = df_account_balances['account_type'].isin(account_types)
+    if account_names:
+        selected &= df_account_balances['account_name'].isin(account_names)
+    return df_account_balances[selected].groupby(['year'])[VALUE_COLUMNS].sum().reset_index()
+
+def frame_names_for_types(df_account_balances, account_types):
+    return df_account_balances[df_account_balances['account_type'].isin(account_types)]['account_name'].unique()
+
+## Function to time a call, median of a few runs, in milliseconds
+def time_ms(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark memory and selection latency of the account balances.')
+    parser.add_argument('--accounts', type=int, default=10_000, help='accounts in the synthetic budget')
+    parser.add_argument('--years', type=int, default=20, help='years of balances per account')
+    parser.add_argument('--repeats', type=int, default=20, help='runs of each selection (the median is reported)')
+    args = parser.parse_args()
+
+    ## The same balances three ways
+    df_strings = synthetic_balances(args.accounts, args.years)
+    df_categories = df_strings.astype({'account_type': 'category', 'account_name': 'category'})
+    start = time.perf_counter()
+    account_balances = ynab_aggregations.AccountBalances.from_frame(df_strings, ACCOUNT_TYPES)
+    build_ms = (time.perf_counter() - start) * 1000
+    layouts = {
+        'frame (strings)': (df_strings, df_strings.memory_usage(deep=True).sum(), frame_year_totals, frame_names_for_types),
+        'frame (categories)': (df_categories, df_categories.memory_usage(deep=True).sum(), frame_year_totals, frame_names_for_types),
+        'AccountBalances': (account_balances, account_balances.nbytes, ynab_aggregations.compute_year_totals, lambda table, account_types: table.names_for_types(account_types)),
+    }
+
+    ## The selections the callbacks make
+    some_names = account_balances.names_for_types(['Registered'])[:20]
+    selections = {
+        'one type': (['Registered'], []),
+        'four types': (ACCOUNT_TYPES[:4], []),
+        'type + 20 names': (['Registered'], some_names),
+    }
+
+    ## Time each selection on each layout, checking they all agree
+    print(f"{args.accounts:,} accounts x {args.years} years ({len(df_strings):,} rows); AccountBalances built in {build_ms:.0f} ms")
+    print(f"{'':>20}  {'memory MB':>9}  " + '  '.join(f'{name:>15}' for name in [*selections, 'name dropdown']) + '  (ms)')
+    expected = {name: frame_year_totals(df_strings, *selection) for name, selection in selections.items()}
+    for layout, (data, nbytes, year_totals, names_for_types) in layouts.items():
+        timings = []
+        for name, selection in selections.items():
+            totals = year_totals(data, *selection)
+            assert np.allclose(totals[VALUE_COLUMNS].to_numpy(float), expected[name][VALUE_COLUMNS].to_numpy(float)), (layout, name)
+            timings.append(time_ms(lambda: year_totals(data, *selection), args.repeats))
+        timings.append(time_ms(lambda: names_for_types(data, ['Registered']), args.repeats))
+        print(f"{layout:>20}  {nbytes / 1e6:>9.1f}  " + '  '.join(f'{timing:>15.2f}' for timing in timings))
@@ -0,0 +1,92 @@
+###############
+## Benchmark ##
+###############
+
+## Times the backend's checkpoint calculations on a synthetic budget of 40 accounts with up to 1M transactions spread
+## over 12 years, doubling the size each step: bucketing every transaction into (account, month) in one bincount,
+## hashing each (account, year)'s transactions, and rolling the months up into year-end balances. Bucketing is linear
+## and the roll-up doesn't depend on the number of transactions, but hashing sorts the transactions first, so it's
+## n log n and the time per transaction creeps up with size. The time per transaction is reported for each step and
+## size, along with how much it has grown since the smallest size, and the run fails (exit code 1) if the total has
+## grown by more than MAX_GROWTH - a sort accounts for a little growth, anything worse than linearithmic for a lot more.
+## Run with: python scripts/benchmark_calculations.py
+
+## Import packages
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import ynab_calculations
+
+## Set vars
+YEARS_RANGE = range(2014, 2026)
+N_ACCOUNTS = 40
+SIZES = [125_000, 250_000, 500_000, 1_000_000]
+REPEATS = 5
+
+## Most the time per transaction may grow from the smallest size to the largest (an 8x bigger budget)
+MAX_GROWTH = float(os.getenv('MAX_GROWTH', '2.0'))
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to build a synthetic budget's transactions in the same shape the store hands back (columns from
+## ynab_calculations.transaction_columns - 'YYYY-MM-DD' bytes, milliunits and ids as bytes)
+def synthetic_transactions(n_transactions, seed=0):
+    rng = np.random.default_rng(seed)
+    first_day = np.datetime64(f"{YEARS_RANGE[0]}-01-01")
+    last_day = np.datetime64(f"{YEARS_RANGE[-1]}-12-31")
+    days = first_day + rng.integers(0, (last_day - first_day).astype(int) + 1, n_transactions)
+    account_codes = rng.integers(0, N_ACCOUNTS, n_transactions)
+    dates = np.datetime_as_string(days, unit='D').astype('S10')
+    amounts = rng.integers(-500_000, 500_000, n_transactions)
+    ids = np.char.encode(np.char.mod('%036x', rng.permutation(n_transactions)), 'ascii')
+    return account_codes, dates, amounts, ids
+
+## Function to time each checkpoint calculation on one synthetic budget, best of a few runs, as {step: seconds}
+def time_engine(n_transactions):
+    account_codes, dates, amounts, ids = synthetic_transactions(n_transactions)
+    timings = {'bucketing': [], 'hashing': [], 'roll-up': []}
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        month_net_flow, month_counts = ynab_calculations.month_buckets(account_codes, dates, amounts, N_ACCOUNTS, YEARS_RANGE)
+        bucketed = time.perf_counter()
+        ynab_calculations.year_content_hashes(account_codes, dates, amounts, ids)
+        hashed = time.perf_counter()
+        ynab_calculations.year_end_from_buckets(*ynab_calculations.roll_up_years(month_net_flow, month_counts))
+        rolled_up = time.perf_counter()
+        timings['bucketing'].append(bucketed - start)
+        timings['hashing'].append(hashed - bucketed)
+        timings['roll-up'].append(rolled_up - hashed)
+    return {step: min(seconds) for step, seconds in timings.items()}
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark how the backend's checkpoint calculations scale.")
+    parser.add_argument('--max-growth', type=float, default=MAX_GROWTH, help='most the time per transaction may grow from the smallest size to the largest')
+    args = parser.parse_args()
+
+    ## Time per transaction for each step and size (the step columns are ns per transaction too), and how much the total
+    ## has grown since the smallest size
+    print(f"{'transactions':>12}  {'seconds':>8}  {'bucketing':>9}  {'hashing':>9}  {'roll-up':>9}  {'ns/transaction':>14}  {'growth':>6}")
+    first_ns = None
+    for n_transactions in SIZES:
+        steps = time_engine(n_transactions)
+        seconds = sum(steps.values())
+        ns = seconds / n_transactions * 1e9
+        first_ns = first_ns or ns
+        step_ns = '  '.join(f'{steps[step] / n_transactions * 1e9:>9.1f}' for step in ['bucketing', 'hashing', 'roll-up'])
+        print(f"{n_transactions:>12,}  {seconds:>8.3f}  {step_ns}  {ns:>14.1f}  {ns / first_ns:>5.2f}x")
+
+    ## Fail the run if the time per transaction grew by more than it should
+    growth = ns / first_ns
+    print(f"Time per transaction grew {growth:.2f}x from {SIZES[0]:,} to {SIZES[-1]:,} transactions (most allowed {args.max_growth:.2f}x).")
+    if growth > args.max_growth:
+        sys.exit(f"Time per transaction grew {growth:.2f}x, over the {args.max_growth:.2f}x allowed.")
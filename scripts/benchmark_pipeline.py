@@ -0,0 +1,168 @@
+###############
+## Benchmark ##
+###############
+
+## Runs the backend end to end against scripts/mock_ynab_server.py and a synthetic budget, recording wall time, peak
+## memory and request counts for each stage (fetch, compute, write) of each run. Three runs are made: a cold one against
+## an empty store, a no-op incremental one, and an incremental one after some edits, deletions and new transactions (and
+## a deleted account). Results are written as JSON so runs can be compared over time. Afterwards the Year in Review's
+## category rankings are checked against the store, deleted accounts are checked to be gone from the store and the
+## outputs, and the benchmark fails if either is off.
+## Run with: python scripts/benchmark_pipeline.py --accounts 40 --years 10 --transactions-per-year 1000
+
+## Import packages
+from datetime import datetime
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import mock_ynab_server
+import ynab_outputs
+import ynab_store
+
+## Set vars
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_PATH = os.path.join(SCRIPTS_DIR, 'ynab_wrapped_backend.py')
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to read the mock server's request counters
+def server_stats(server):
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/__stats") as response:
+        return json.load(response)
+
+## Function to run the backend once, returning its wall time, peak memory, request counts and stage timings
+def run_backend(name, server, budget_id, work_dir, first_year, extra_env):
+    metrics_path = os.path.join(work_dir, f"metrics-{name}.jsonl")
+    env = dict(
+        os.environ,
+        YNAB_WRAPPED_DIR=work_dir,
+        YNAB_BASE_URL=server.base_url,
+        API_KEY='mock',
+        BUDGET_ID=budget_id,
+        FIRST_YEAR=str(first_year),
+        METRICS_PATH=metrics_path,
+        **extra_env
+    )
+    server.reset_stats()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, BACKEND_PATH], env=env, cwd=SCRIPTS_DIR, stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"Backend run '{name}' failed with exit code {process.returncode}.")
+    with open(metrics_path) as f:
+        events = [json.loads(line) for line in f]
+    stages = [
+        {'stage': event['labels']['stage'], 'seconds': event['value'], 'requests': event['requests'], 'peak_rss_mb': event['peak_rss_mb']}
+        for event in events if event['name'] == 'stage_seconds'
+    ]
+    counters = {}
+    for event in events:
+        if event['type'] == 'counter':
+            counters[event['name']] = counters.get(event['name'], 0) + event['value']
+    return {
+        'run': name,
+        'wall_seconds': wall_seconds,
+        'peak_rss_mb': rusage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024),  ## bytes on macOS, KB on Linux
+        'server': server_stats(server),
+        'stages': stages,
+        'counters': counters,
+    }
+
+## Function to check the Year in Review's biggest category changes against the store they came from - every year's
+## ranking should be the categories sorted by how far their spend moved, largest first - and that there's any spend at
+## all when the budget has on-budget accounts (whatever FETCH_MODE synced)
+def check_category_deltas(store_path, expect_spend):
+    conn = ynab_store.open_store_readonly(store_path)
+    if expect_spend and not conn.execute("SELECT COUNT(*) FROM category_months").fetchone()[0]:
+        raise RuntimeError("The Year in Review has no spend, though the budget has on-budget accounts.")
+    for year in sorted(ynab_store.get_rollup_years(conn)):
+        deltas = ynab_store.get_category_deltas(conn, year, limit=-1)  ## SQLite reads a negative LIMIT as no limit
+        changes = [abs(spend - previous_spend) for _, spend, previous_spend in deltas]
+        if changes != sorted(changes, reverse=True):
+            raise RuntimeError(f"Category changes for {year} are out of order: {deltas[:5]}")
+        spend = dict(conn.execute("SELECT category_name, SUM(spend) FROM category_months WHERE year = ? GROUP BY category_name", (year,)).fetchall())
+        if any(spend.get(name, 0) != year_spend for name, year_spend, _ in deltas):
+            raise RuntimeError(f"Category spend for {year} doesn't match category_months.")
+    conn.close()
+
+## Function to check that accounts deleted in YNAB are gone from the store - with nothing left filed under them - and
+## from the account balances the app reads
+def check_deleted_accounts(work_dir, budget):
+    deleted = {account['id']: account['name'] for account in budget.accounts if account['deleted']}
+    conn = ynab_store.open_store_readonly(os.path.join(work_dir, 'intermediate outputs', 'transaction_store', f'{budget.id}.sqlite'))
+    if any(account['id'] in deleted for account in ynab_store.get_accounts(conn)):
+        raise RuntimeError("Deleted accounts are still in the store.")
+    if conn.execute(f"SELECT COUNT(*) FROM transactions WHERE account_id IN ({','.join('?' * len(deleted))})", list(deleted)).fetchone()[0]:
+        raise RuntimeError("Transactions of deleted accounts are still in the store.")
+    conn.close()
+    balances = ynab_outputs.read_account_balances(os.path.join(work_dir, 'intermediate outputs', 'budgets', budget.id, 'account_balances'), columns=['account_name'])
+    if set(balances['account_name']) & set(deleted.values()):
+        raise RuntimeError("Deleted accounts are still in the account balances.")
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the backend against a mock YNAB API.')
+    mock_ynab_server.add_budget_arguments(parser)
+    parser.add_argument('--fetch-mode', default='bulk', choices=['bulk', 'account'])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every API response, to mimic a real round trip')
+    parser.add_argument('--updates', type=int, default=50, help='transactions edited before the incremental run')
+    parser.add_argument('--deletes', type=int, default=10, help='transactions deleted before the incremental run')
+    parser.add_argument('--inserts', type=int, default=50, help='transactions added before the incremental run')
+    parser.add_argument('--deleted-accounts', type=int, default=1, help='accounts deleted before the incremental run')
+    parser.add_argument('--results', default=None, help='where to write the JSON results (default benchmark_results/pipeline-<timestamp>.json)')
+    args = parser.parse_args()
+    args.budgets = 1
+
+    ## Build the budget and serve it, with a rate limit high enough not to get in the way
+    print(f"Generating {args.accounts} accounts x {args.years} years x {args.transactions_per_year} transactions.")
+    budget = mock_ynab_server.make_budgets(args)[0]
+    server = mock_ynab_server.MockYnabServer([budget], rate_limit=1_000_000, latency=args.latency_ms / 1000).start()
+    first_year = datetime.now().year - args.years + 1
+    extra_env = {'FETCH_MODE': args.fetch_mode, 'FETCH_WORKERS': str(args.workers)}
+
+    ## Cold, no-op and incremental runs, all against the same store
+    runs = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        runs.append(run_backend('cold', server, budget.id, work_dir, first_year, extra_env))
+        runs.append(run_backend('noop', server, budget.id, work_dir, first_year, extra_env))
+        budget.mutate(updates=args.updates, deletes=args.deletes, inserts=args.inserts, deleted_accounts=args.deleted_accounts)
+        runs.append(run_backend('incremental', server, budget.id, work_dir, first_year, extra_env))
+        check_category_deltas(
+            os.path.join(work_dir, 'intermediate outputs', 'transaction_store', f'{budget.id}.sqlite'),
+            expect_spend=any(account['on_budget'] and not account['deleted'] for account in budget.accounts)
+        )
+        check_deleted_accounts(work_dir, budget)
+    server.shutdown()
+
+    ## Print a summary
+    for run in runs:
+        stages = ', '.join(f"{stage['stage']} {stage['seconds']:.2f}s/{stage['requests']} req" for stage in run['stages'])
+        print(f"{run['run']:>12}: {run['wall_seconds']:.2f}s, {run['peak_rss_mb']:.0f} MB peak, {run['server']['requests']} requests, {run['server']['bytes_sent'] / 1e6:.1f} MB down ({stages})")
+
+    ## Write the results
+    results_path = args.results or os.path.join('benchmark_results', f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    with open(results_path, 'w') as f:
+        json.dump({
+            'benchmark': 'pipeline',
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {key: value for key, value in vars(args).items() if key != 'results'},
+            'transactions': len(budget.tx_ids),
+            'runs': runs,
+        }, f, indent=2)
+    print(f"Wrote {results_path}.")
@@ -0,0 +1,166 @@
+###############
+## Benchmark ##
+###############
+
+## Times how long the backend and the Dash app take to start from cold - a fresh interpreter every time, the way an
+## on-demand or autoscaled deployment pays for it. Each is run under python -X importtime, so alongside the wall time we
+## get where the import time goes. The backend runs end to end against scripts/mock_ynab_server.py, and its startup is
+## everything before its first stage begins; the app's startup is importing ynab_wrapped (loading the data and
+## building the layout included), against the outputs the backend just wrote. Results are written as JSON so runs can
+## be compared over time, and the run fails (exit code 1) if either median start-up goes over its budget.
+## Run with: python scripts/benchmark_startup.py --repeats 5
+
+## Import packages
+from datetime import datetime
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import mock_ynab_server
+
+## Set vars
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_PATH = os.path.join(SCRIPTS_DIR, 'ynab_wrapped_backend.py')
+TOP_IMPORTS = 10
+
+## Start-up time budgets, in seconds - the backend's start-up before its first stage, and importing the app
+BACKEND_STARTUP_BUDGET = float(os.getenv('BACKEND_STARTUP_BUDGET', '1.0'))
+APP_IMPORT_BUDGET = float(os.getenv('APP_IMPORT_BUDGET', '2.5'))
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to parse python -X importtime output into (depth, module, cumulative seconds) rows, in the order printed
+def parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative) / 1e6))
+    return rows
+
+## Function to pick the heaviest imports at a given depth, optionally only those under one module
+def top_imports(rows, depth, parent=None):
+    imports, inside = [], parent is None
+    for row_depth, name, seconds in reversed(rows):  ## importtime prints children before their parent
+        if parent is not None and row_depth == depth - 1:
+            inside = name == parent
+        elif row_depth == depth and inside:
+            imports.append({'module': name, 'seconds': seconds})
+    return sorted(imports, key=lambda row: row['seconds'], reverse=True)[:TOP_IMPORTS]
+
+## Function to run a command under -X importtime, returning its wall time and parsed import times
+def run_timed(args, env, stdout=subprocess.DEVNULL):
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', *args], env=env, cwd=SCRIPTS_DIR, stdout=stdout, stderr=subprocess.PIPE, text=True)
+    wall_seconds = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed with exit code {process.returncode}:\n{process.stderr[-2000:]}")
+    return wall_seconds, parse_importtime(process.stderr)
+
+## Function to start the backend once from cold - startup is the wall time not spent in any of its stages
+def run_backend(env, metrics_path):
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    wall_seconds, rows = run_timed([BACKEND_PATH], env)
+    with open(metrics_path) as f:
+        stage_seconds = sum(event['value'] for event in map(json.loads, f) if event['name'] == 'stage_seconds')
+    return {'wall_seconds': wall_seconds, 'startup_seconds': wall_seconds - stage_seconds, 'top_imports': top_imports(rows, 0)}
+
+## Function to start the Dash app once from cold - importing it loads every budget and builds the layout
+def run_app(env):
+    wall_seconds, rows = run_timed(['-c', 'import ynab_wrapped'], env)
+    import_seconds = next(seconds for depth, name, seconds in rows if depth == 0 and name == 'ynab_wrapped')
+    return {'wall_seconds': wall_seconds, 'import_seconds': import_seconds, 'top_imports': top_imports(rows, 1, parent='ynab_wrapped')}
+
+## Function to summarise repeated runs - the median of each timing, and the heaviest imports from the median run
+def summarise(runs, key):
+    runs = sorted(runs, key=lambda run: run[key])
+    median_run = runs[len(runs) // 2]
+    return {
+        **{name: statistics.median(run[name] for run in runs) for name in runs[0] if name.endswith('_seconds')},
+        'top_imports': median_run['top_imports'],
+    }
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark cold start times for the backend and the Dash app.')
+    mock_ynab_server.add_budget_arguments(parser)
+    parser.add_argument('--repeats', type=int, default=5, help='cold starts of each script (the median is reported)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every API response, to mimic a real round trip')
+    parser.add_argument('--backend-budget', type=float, default=BACKEND_STARTUP_BUDGET, help='most seconds the backend may take to start')
+    parser.add_argument('--app-budget', type=float, default=APP_IMPORT_BUDGET, help='most seconds importing the app may take')
+    parser.add_argument('--results', default=None, help='where to write the JSON results (default benchmark_results/startup-<timestamp>.json)')
+    args = parser.parse_args()
+    args.budgets = 1
+
+    ## Build the budget and serve it, with a rate limit high enough not to get in the way
+    budget = mock_ynab_server.make_budgets(args)[0]
+    server = mock_ynab_server.MockYnabServer([budget], rate_limit=1_000_000, latency=args.latency_ms / 1000).start()
+    first_year = datetime.now().year - args.years + 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+        env = dict(
+            os.environ,
+            YNAB_WRAPPED_DIR=work_dir,
+            YNAB_BASE_URL=server.base_url,
+            API_KEY='mock',
+            BUDGET_ID=budget.id,
+            FIRST_YEAR=str(first_year),
+            METRICS_PATH=metrics_path,
+        )
+
+        ## A bare interpreter for reference, then a first backend run to fill the store and write the app's outputs
+        interpreter_seconds = statistics.median(run_timed(['-c', 'pass'], env)[0] for _ in range(args.repeats))
+        run_backend(env, metrics_path)
+
+        ## Cold starts of each - the backend's later runs are incremental no-ops, so they're mostly startup
+        backend = summarise([run_backend(env, metrics_path) for _ in range(args.repeats)], 'startup_seconds')
+        app = summarise([run_app(env) for _ in range(args.repeats)], 'import_seconds')
+    server.shutdown()
+
+    ## Check the medians against their budgets
+    over_budget = [
+        f"{name} took {seconds:.2f}s, over its {budget:.2f}s budget"
+        for name, seconds, budget in [('backend start-up', backend['startup_seconds'], args.backend_budget), ('app import', app['import_seconds'], args.app_budget)]
+        if seconds > budget
+    ]
+
+    ## Print a summary
+    heaviest = lambda result: ', '.join(f"{row['module']} {row['seconds']:.2f}s" for row in result['top_imports'][:5])
+    print(f"{'interpreter':>12}: {interpreter_seconds:.2f}s")
+    print(f"{'backend':>12}: {backend['startup_seconds']:.2f}s to start (budget {args.backend_budget:.2f}s), {backend['wall_seconds']:.2f}s end to end (heaviest imports: {heaviest(backend)})")
+    print(f"{'app':>12}: {app['import_seconds']:.2f}s to import (budget {args.app_budget:.2f}s), {app['wall_seconds']:.2f}s end to end (heaviest imports: {heaviest(app)})")
+
+    ## Write the results
+    results_path = args.results or os.path.join('benchmark_results', f"startup-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    with open(results_path, 'w') as f:
+        json.dump({
+            'benchmark': 'startup',
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'config': {key: value for key, value in vars(args).items() if key != 'results'},
+            'interpreter_seconds': interpreter_seconds,
+            'backend': backend,
+            'app': app,
+            'over_budget': over_budget,
+        }, f, indent=2)
+    print(f"Wrote {results_path}.")
+
+    ## Fail the run if anything went over budget
+    if over_budget:
+        sys.exit(f"Over the start-up budget: {'; '.join(over_budget)}.")
@@ -0,0 +1,43 @@
+// Checks that Hide Numbers (maskFigure in assets/ynab_wrapped.js) masks the dollar amounts in the app's figures and
+// leaves the year and label axes readable, on figures laid out the way update_charts and spend_figure lay them out.
+// Run with: node scripts/check_hide_numbers.js
+
+const assert = require('assert');
+const fs = require('fs');
+const path = require('path');
+const vm = require('vm');
+
+// Load the app's clientside script the way the browser does, with a bare window
+const context = {window: {}};
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(path.join(__dirname, 'assets', 'ynab_wrapped.js'), 'utf8'), context);
+const maskFigure = function (figure) {  // Copied back out of the script's realm, so arrays compare as plain arrays
+    return JSON.parse(JSON.stringify(context.maskFigure(figure)));
+};
+const HIDDEN = vm.runInContext('HIDDEN', context);  // A top-level const, so not a property of the window
+
+// Balance Over Time - years on the x-axis, dollar tick labels on the y-axis
+const balance = maskFigure({
+    data: [{type: 'scatter', x: [2023, 2024], y: [1000, 2500], text: ['$1,000.00', '$2,500.00']}],
+    layout: {
+        xaxis: {tickmode: 'array', tickvals: [2023, 2024], ticktext: ['2023', '2024'], dtick: 1},
+        yaxis: {tickvals: [1000, 2500], ticktext: ['$1,000', '$2,500'], tickformat: '$,0.0f'}
+    }
+});
+assert.deepStrictEqual(balance.layout.xaxis.ticktext, ['2023', '2024'], 'year labels should survive masking');
+assert.deepStrictEqual(balance.layout.yaxis.ticktext, [HIDDEN, HIDDEN], 'dollar tick labels should be masked');
+assert.deepStrictEqual(balance.data[0].text, [HIDDEN, HIDDEN], 'hovertext should be masked');
+
+// Year in Review, horizontal - dollars on the x-axis, category names on the y-axis
+const categories = maskFigure({
+    data: [{type: 'bar', orientation: 'h', x: [500, 300], y: ['Groceries', 'Rent'], text: ['$500.00', '$300.00']}],
+    layout: {
+        xaxis: {tickprefix: '$', tickformat: ',.0f'},
+        yaxis: {tickmode: 'array', tickvals: ['Groceries', 'Rent'], ticktext: ['Groceries', 'Rent'], automargin: true}
+    }
+});
+assert.strictEqual(categories.layout.xaxis.showticklabels, false, 'automatic dollar ticks should be hidden');
+assert.deepStrictEqual(categories.layout.yaxis.ticktext, ['Groceries', 'Rent'], 'category labels should survive masking');
+assert.notStrictEqual(categories.layout.yaxis.showticklabels, false, 'category labels should stay shown');
+
+console.log('Hide Numbers masks dollar amounts and leaves year and label axes alone.');
@@ -0,0 +1,304 @@
+######################
+## Mock YNAB Server ##
+######################
+
+## A local stand-in for the parts of the YNAB API the backend uses - budgets, accounts and transactions (budget-wide and
+## per account), with server_knowledge deltas, since_date and X-Rate-Limit headers - serving a synthetic budget. Lets the
+## backend run (and be benchmarked) without a real API_KEY.
+## Run with: python scripts/mock_ynab_server.py --accounts 20 --years 10 --transactions-per-year 500 --port 8080
+## then point the backend at it with YNAB_BASE_URL=http://127.0.0.1:8080/v1 API_KEY=mock BUDGET_ID=mock-budget
+
+## Import packages
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from datetime import date, datetime
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import random
+import threading
+import time
+
+## Account names cycle through these so every group in account_groupings.json gets some accounts (and some get none)
+ACCOUNT_NAME_TEMPLATES = ['TFSA', 'RRSP', 'Non-Registered', 'TFSA Gains', 'Mortgage', 'House', 'Chequing', 'DPSP', 'LIRA', 'Savings']
+## These are on-budget accounts, like a real budget's - the rest are tracking accounts, whose transactions have no category
+ON_BUDGET_TEMPLATES = {'Chequing', 'Savings'}
+
+## Payees and categories are picked from these by transaction number, and every tenth transaction gets a memo
+PAYEE_NAMES = ['Grocery Store', 'Coffee Shop', 'Landlord', 'Hydro', 'Employer', 'Brokerage', 'Gas Station', 'Restaurant', 'Pharmacy', 'Airline', 'Bookstore']
+CATEGORY_NAMES = ['Groceries', 'Dining Out', 'Rent', 'Utilities', 'Income', 'Investments', 'Transportation', 'Health', 'Travel']
+
+## Transactions are streamed out in chunks of this many rows, so a big response never sits in memory as one string
+ROWS_PER_CHUNK = 5000
+
+
+######################
+## Define Functions ##
+######################
+
+## A synthetic budget, with transactions held as parallel columns rather than a dict per row to keep big budgets cheap
+class SyntheticBudget:
+
+    def __init__(self, budget_id, n_accounts, first_year, last_year, transactions_per_year, seed=0):
+        rng = random.Random(seed)
+        self.id = budget_id
+        self.name = f"Synthetic Budget {budget_id}"
+        self.knowledge = 1
+        self.accounts = [
+            {
+                'id': f"{budget_id}-account-{i}",
+                'name': f"{ACCOUNT_NAME_TEMPLATES[i % len(ACCOUNT_NAME_TEMPLATES)]} {i}",
+                'type': 'checking' if ACCOUNT_NAME_TEMPLATES[i % len(ACCOUNT_NAME_TEMPLATES)] in ON_BUDGET_TEMPLATES else 'otherAsset',
+                'on_budget': ACCOUNT_NAME_TEMPLATES[i % len(ACCOUNT_NAME_TEMPLATES)] in ON_BUDGET_TEMPLATES,
+                'closed': False,
+                'deleted': False,
+                'balance': 0,
+            }
+            for i in range(n_accounts)
+        ]
+        self.account_knowledge = [self.knowledge] * n_accounts
+        self.on_budget_ids = {account['id'] for account in self.accounts if account['on_budget']}
+        self.tx_ids, self.tx_account_ids, self.tx_dates, self.tx_amounts, self.tx_deleted, self.tx_knowledge = [], [], [], [], [], []
+        for account in self.accounts:
+            for year in range(first_year, last_year + 1):
+                first_day = date(year, 1, 1).toordinal()
+                days_in_year = date(year, 12, 31).toordinal() - first_day + 1
+                for _ in range(transactions_per_year):
+                    self.add_transaction(account['id'], date.fromordinal(first_day + rng.randrange(days_in_year)).isoformat(), rng.randint(-500_000, 1_000_000))
+        self.rng = rng
+
+    ## Add one transaction at the current knowledge
+    def add_transaction(self, account_id, tx_date, amount):
+        self.tx_ids.append(f"{self.id}-tx-{len(self.tx_ids)}")
+        self.tx_account_ids.append(account_id)
+        self.tx_dates.append(tx_date)
+        self.tx_amounts.append(amount)
+        self.tx_deleted.append(False)
+        self.tx_knowledge.append(self.knowledge)
+
+    ## Simulate activity since the last sync - delete some accounts (and their transactions, as YNAB only lets an empty
+    ## account be deleted), then edit, delete and add some transactions, all at a new knowledge
+    def mutate(self, updates=0, deletes=0, inserts=0, deleted_accounts=0):
+        self.knowledge += 1
+        for i in self.rng.sample([i for i, account in enumerate(self.accounts) if not account['deleted']], deleted_accounts):
+            self.accounts[i] = dict(self.accounts[i], deleted=True)
+            self.account_knowledge[i] = self.knowledge
+            for j, account_id in enumerate(self.tx_account_ids):
+                if account_id == self.accounts[i]['id'] and not self.tx_deleted[j]:
+                    self.tx_deleted[j] = True
+                    self.tx_knowledge[j] = self.knowledge
+        live = [i for i, deleted in enumerate(self.tx_deleted) if not deleted]
+        for i in self.rng.sample(live, min(updates + deletes, len(live))):
+            if deletes > 0:
+                self.tx_deleted[i] = True
+                deletes -= 1
+            else:
+                self.tx_amounts[i] += self.rng.randint(-10_000, 10_000)
+            self.tx_knowledge[i] = self.knowledge
+        for _ in range(inserts):
+            self.add_transaction(self.rng.choice([account for account in self.accounts if not account['deleted']])['id'], date.today().isoformat(), self.rng.randint(-500_000, 1_000_000))
+
+    ## Accounts that changed after last_knowledge (deleted ones only show up in deltas, as with the real API)
+    def account_rows(self, last_knowledge=0):
+        return [
+            account for account, knowledge in zip(self.accounts, self.account_knowledge)
+            if knowledge > last_knowledge and not (account['deleted'] and last_knowledge == 0)
+        ]
+
+    ## Rows that changed after last_knowledge (deleted ones only show up in deltas, as with the real API)
+    def transaction_rows(self, last_knowledge=0, since_date=None, account_id=None):
+        for i, knowledge in enumerate(self.tx_knowledge):
+            if knowledge <= last_knowledge or (self.tx_deleted[i] and last_knowledge == 0):
+                continue
+            if account_id is not None and self.tx_account_ids[i] != account_id:
+                continue
+            if since_date is not None and self.tx_dates[i] < since_date:
+                continue
+            yield i
+
+    ## JSON for one transaction, in the shape the API returns
+    def transaction_json(self, i):
+        memo = f'"Note {i}"' if i % 10 == 0 else 'null'
+        category = f'"{CATEGORY_NAMES[i % len(CATEGORY_NAMES)]}"' if self.tx_account_ids[i] in self.on_budget_ids else 'null'
+        return (
+            f'{{"id":"{self.tx_ids[i]}","date":"{self.tx_dates[i]}","amount":{self.tx_amounts[i]},"memo":{memo},'
+            f'"cleared":"cleared","approved":true,"account_id":"{self.tx_account_ids[i]}","payee_name":"{PAYEE_NAMES[i % len(PAYEE_NAMES)]}",'
+            f'"category_name":{category},"deleted":{"true" if self.tx_deleted[i] else "false"},"subtransactions":[]}}'
+        )
+
+## Request handler - routes are matched on the path split into segments
+class MockYnabHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  ## Keep-alive, so pooled sessions behave like they do against the real API
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+
+        ## Stats aren't rate limited or counted
+        if parts == ['__stats']:
+            return self.send_json(200, server.stats())
+
+        ## Everything else counts against the rate limit
+        used = server.take_request(url.path)
+        if used > server.rate_limit:
+            return self.send_json(429, {'error': {'id': '429', 'name': 'too_many_requests', 'detail': 'Too many requests'}}, used)
+        if server.latency:
+            time.sleep(server.latency)
+
+        if parts == ['v1', 'budgets']:
+            return self.send_json(200, {'data': {'budgets': [{'id': budget.id, 'name': budget.name} for budget in server.budgets.values()]}}, used)
+        if len(parts) < 4 or parts[:2] != ['v1', 'budgets'] or parts[2] not in server.budgets:
+            return self.send_json(404, {'error': {'id': '404', 'name': 'not_found', 'detail': 'Not found'}}, used)
+
+        budget = server.budgets[parts[2]]
+        last_knowledge = int(params.get('last_knowledge_of_server', 0))
+        if parts[3:] == ['accounts']:
+            with server.lock:
+                accounts = budget.account_rows(last_knowledge)
+            return self.send_json(200, {'data': {'accounts': accounts, 'server_knowledge': budget.knowledge}}, used)
+
+        ## Pick the rows under the lock, then stream them out without holding it
+        with server.lock:
+            if parts[3:] == ['transactions']:
+                rows = list(budget.transaction_rows(last_knowledge, params.get('since_date')))
+            elif len(parts) == 6 and parts[3] == 'accounts' and parts[5] == 'transactions':
+                rows = list(budget.transaction_rows(last_knowledge, params.get('since_date'), parts[4]))
+            else:
+                rows = None
+            knowledge = budget.knowledge
+        if rows is None:
+            return self.send_json(404, {'error': {'id': '404', 'name': 'not_found', 'detail': 'Not found'}}, used)
+        self.send_transactions(budget, rows, knowledge, used)
+
+    ## Mutations and stats resets, for benchmarks that measure incremental runs
+    def do_POST(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = {key: int(values[0]) for key, values in parse_qs(url.query).items() if key != 'budget'}
+        budget_id = parse_qs(url.query).get('budget', [next(iter(server.budgets))])[0]
+        if url.path == '/__mutate':
+            with server.lock:
+                server.budgets[budget_id].mutate(**params)
+            return self.send_json(200, {'server_knowledge': server.budgets[budget_id].knowledge})
+        if url.path == '/__reset_stats':
+            server.reset_stats()
+            return self.send_json(200, {})
+        return self.send_json(404, {})
+
+    ## Send a small JSON body
+    def send_json(self, status, body, used=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if used is not None:
+            self.send_header('X-Rate-Limit', f"{min(used, self.server.rate_limit)}/{self.server.rate_limit}")
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.add_bytes(len(payload))
+
+    ## Stream a transactions body out in chunks
+    def send_transactions(self, budget, rows, knowledge, used):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('X-Rate-Limit', f"{used}/{self.server.rate_limit}")
+        self.end_headers()
+        self.write_chunk('{"data":{"transactions":[')
+        for start in range(0, len(rows), ROWS_PER_CHUNK):
+            prefix = ',' if start else ''
+            self.write_chunk(prefix + ','.join(budget.transaction_json(i) for i in rows[start:start + ROWS_PER_CHUNK]))
+        self.write_chunk(f'],"server_knowledge":{knowledge}}}}}')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.server.add_bytes(len(data))
+
+## The server itself - holds the budgets, the per-hour request window and request/byte counters
+class MockYnabServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, budgets, port=0, rate_limit=200, rate_limit_window=3600, latency=0.0):
+        super().__init__(('127.0.0.1', port), MockYnabHandler)
+        self.budgets = {budget.id: budget for budget in budgets}
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.window = deque()
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    ## Count a request against the rolling window, returning how many have been used in it (including this one)
+    def take_request(self, path):
+        with self.stats_lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] >= self.rate_limit_window:
+                self.window.popleft()
+            self.window.append(now)
+            self.requests += 1
+            endpoint = 'transactions' if path.endswith('/transactions') else path.rsplit('/', 1)[-1]
+            self.requests_by_endpoint[endpoint] = self.requests_by_endpoint.get(endpoint, 0) + 1
+            return len(self.window)
+
+    def add_bytes(self, n):
+        with self.stats_lock:
+            self.bytes_sent += n
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests = 0
+            self.requests_by_endpoint = {}
+            self.bytes_sent = 0
+
+    def stats(self):
+        with self.stats_lock:
+            return {'requests': self.requests, 'requests_by_endpoint': dict(self.requests_by_endpoint), 'bytes_sent': self.bytes_sent}
+
+    ## Serve from a background thread (for benchmarks running in the same process)
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+#########
+## Run ##
+#########
+
+## Function to build the command line options shared with the benchmark harness
+def add_budget_arguments(parser):
+    parser.add_argument('--budgets', type=int, default=1, help='number of synthetic budgets')
+    parser.add_argument('--accounts', type=int, default=20, help='accounts per budget')
+    parser.add_argument('--years', type=int, default=5, help='years of history, ending this year')
+    parser.add_argument('--transactions-per-year', type=int, default=500, help='transactions per account per year')
+    parser.add_argument('--seed', type=int, default=0)
+
+## Function to build the synthetic budgets described by the command line options
+def make_budgets(args):
+    last_year = datetime.now().year
+    return [
+        SyntheticBudget(f"mock-budget{'' if i == 0 else f'-{i + 1}'}", args.accounts, last_year - args.years + 1, last_year, args.transactions_per_year, args.seed + i)
+        for i in range(args.budgets)
+    ]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic YNAB budgets locally.')
+    add_budget_arguments(parser)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rate-limit', type=int, default=200, help='requests per rolling hour before 429s')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every API response, to mimic a real round trip')
+    args = parser.parse_args()
+    server = MockYnabServer(make_budgets(args), args.port, args.rate_limit, latency=args.latency_ms / 1000)
+    print(f"Serving {', '.join(server.budgets)} at {server.base_url} (first year {datetime.now().year - args.years + 1}).")
+    server.serve_forever()
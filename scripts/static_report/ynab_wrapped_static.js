@@ -0,0 +1,144 @@
+// Static YNAB Wrapped report. Does in the browser what the Dash app's callbacks do on the server - lists the account
+// names for the selected account types, sums the selected accounts by year and builds the Balance Over Time and
+// Changes in Balance Over Time figures - over the series ynab_wrapped_export.py wrote to data.js. Hide Numbers uses the
+// app's own maskFigure (ynab_wrapped.js).
+
+(function () {
+    const data = window.YNAB_WRAPPED_DATA;
+    const budgetSelect = document.getElementById('budget');
+    const hideNumbersBox = document.getElementById('hide-numbers');
+    const typeSelect = document.getElementById('account-type');
+    const nameSelect = document.getElementById('account-name');
+
+    // Same as Python's f"${x:,.2f}" (or .0f), e.g. $-1,234.50 - toFixed rounds the exact binary value like Python does,
+    // except that Python rounds exact ties to even
+    function formatDollars(value, decimals) {
+        const scaled = Math.abs(value) * Math.pow(10, decimals);
+        let fixed = Math.abs(value).toFixed(decimals);
+        if (scaled - Math.floor(scaled) === 0.5 && Math.floor(scaled) % 2 === 0) {
+            fixed = (Math.floor(scaled) / Math.pow(10, decimals)).toFixed(decimals);
+        }
+        const parts = fixed.split('.');
+        parts[0] = parts[0].replace(/\B(?=(\d{3})+(?!\d))/g, ',');
+        return '$' + (value < 0 ? '-' : '') + parts.join('.');
+    }
+
+    function selectedValues(select) {
+        return Array.from(select.selectedOptions).map(function (option) { return option.value; });
+    }
+
+    function setOptions(select, values, selected) {
+        select.replaceChildren.apply(select, values.map(function (value) {
+            const option = document.createElement('option');
+            option.value = value;
+            option.textContent = value;
+            option.selected = selected.indexOf(value) !== -1;
+            return option;
+        }));
+    }
+
+    function currentBudget() {
+        return data.budgets.find(function (budget) { return budget.id === budgetSelect.value; });
+    }
+
+    // Indexes of the series for the selected account types and names (all accounts of those types if no names are selected)
+    function selectedSeries(budget, accountTypes, accountNames) {
+        const rows = [];
+        budget.type.forEach(function (typeIndex, row) {
+            if (accountTypes.indexOf(budget.account_types[typeIndex]) !== -1 &&
+                (accountNames.length === 0 || accountNames.indexOf(budget.account_name[row]) !== -1)) {
+                rows.push(row);
+            }
+        });
+        return rows;
+    }
+
+    // Per-year totals of one of the series' values over a set of rows, for the budget's years or none (still in milliunits for dollar amounts)
+    function yearTotals(budget, key, rows, years) {
+        return years.map(function (_, yearIndex) {
+            return rows.reduce(function (total, row) { return total + budget[key][row][yearIndex]; }, 0);
+        });
+    }
+
+    // Year axis and dollar axis, laid out like the app's charts
+    function chartLayout(title, years, values) {
+        return {
+            title: {text: title},
+            plot_bgcolor: '#272b30',
+            paper_bgcolor: '#272b30',
+            font: {color: 'white'},
+            xaxis: {title: {text: 'Year'}, tickmode: 'array', tickvals: years, ticktext: years.map(String), dtick: 1, tickfont: {color: 'white'}},
+            yaxis: {tickvals: values, ticktext: values.map(function (value) { return formatDollars(value, 0); }), tickformat: '$,0.0f', tickfont: {color: 'white'}}
+        };
+    }
+
+    // The two figures for a selection - the same ones update_charts builds in the app
+    function buildFigures(budget, accountTypes, accountNames) {
+        const rows = selectedSeries(budget, accountTypes, accountNames);
+        // Nothing selected gives no years at all, not a row of zeros - the app's groupby comes back empty the same way
+        const years = rows.length > 0 ? budget.years : [];
+        const toDollars = function (milliunits) { return milliunits / 1000; };
+        const balances = yearTotals(budget, 'balance', rows, years).map(toDollars);
+        const changes = yearTotals(budget, 'change', rows, years).map(toDollars);
+        // The app leaves the budget's first year out of the changes chart - it has no year before it to change from
+        const changeYears = years.filter(function (year) { return year !== budget.first_year; });
+        const changeValues = changes.filter(function (_, yearIndex) { return years[yearIndex] !== budget.first_year; });
+        return {
+            balance: {
+                data: [{
+                    type: 'scatter', x: years, y: balances, mode: 'lines+markers', name: 'Balance Over Time',
+                    text: balances.map(function (value) { return formatDollars(value, 2); }), hoverinfo: 'text'
+                }],
+                layout: chartLayout('Balance Over Time', years, balances)
+            },
+            changes: {
+                data: [{
+                    type: 'bar', x: changeYears, y: changeValues, name: 'Changes in Balance',
+                    text: changeValues.map(function (value) { return formatDollars(value, 2); }), textposition: 'none', hoverinfo: 'text'
+                }],
+                layout: chartLayout('Changes in Balance Over Time', changeYears, changeValues)
+            }
+        };
+    }
+
+    function renderCharts() {
+        const figures = buildFigures(currentBudget(), selectedValues(typeSelect), selectedValues(nameSelect));
+        const hideNumbers = hideNumbersBox.checked;
+        [['balance-over-time', figures.balance], ['changes-over-time', figures.changes]].forEach(function (chart) {
+            const figure = hideNumbers ? maskFigure(chart[1]) : chart[1];
+            Plotly.react(chart[0], figure.data, figure.layout, {responsive: true});
+        });
+    }
+
+    // Account names for the selected account types, keeping whatever is still selected
+    function updateAccountNames() {
+        const budget = currentBudget();
+        const accountTypes = selectedValues(typeSelect);
+        const names = [];
+        budget.type.forEach(function (typeIndex, row) {
+            const name = budget.account_name[row];
+            if (accountTypes.indexOf(budget.account_types[typeIndex]) !== -1 && names.indexOf(name) === -1) {
+                names.push(name);
+            }
+        });
+        setOptions(nameSelect, names, selectedValues(nameSelect));
+        renderCharts();
+    }
+
+    // Switching budget starts again from its first account type and every account
+    function updateBudget() {
+        const budget = currentBudget();
+        setOptions(typeSelect, budget.account_types, budget.account_types.slice(0, 1));
+        setOptions(nameSelect, [], []);
+        updateAccountNames();
+    }
+
+    setOptions(budgetSelect, data.budgets.map(function (budget) { return budget.id; }), [data.budgets[0].id]);
+    Array.from(budgetSelect.options).forEach(function (option, index) { option.textContent = data.budgets[index].name; });
+    document.getElementById('generated').textContent = 'Exported ' + data.generated;
+    budgetSelect.addEventListener('change', updateBudget);
+    typeSelect.addEventListener('change', updateAccountNames);
+    nameSelect.addEventListener('change', renderCharts);
+    hideNumbersBox.addEventListener('change', renderCharts);
+    updateBudget();
+})();
@@ -0,0 +1,174 @@
+##################
+## Aggregations ##
+##################
+
+## Import packages
+from collections import OrderedDict
+import threading
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+## The chart and callout callbacks both need the same per-year totals for the selected accounts, and toggling Hide
+## Numbers doesn't change them, so they're computed once per selection and kept in a small LRU cache shared by every
+## callback (and every user of the app). Entries are keyed on the budget's outputs version, so anything computed from
+## data that has since been rewritten is dropped rather than served.
+AGGREGATION_CACHE_SIZE = int(os.getenv('AGGREGATION_CACHE_SIZE', '256'))
+
+## The account balances themselves are held as an AccountBalances table rather than a long pandas frame: one row per
+## (account_type, account_name) series, sorted by type and then name, with a column per year. Every type is then a
+## contiguous block of rows, so picking account types is slicing, account names are matched as integer codes, and a
+## selection's per-year totals are column sums. Dollar amounts are kept as int64 milliunits, so totals are exact.
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to normalize a dropdown selection into a hashable key - sorted account types, and sorted account names
+## (empty meaning every account of those types)
+def normalize_selection(account_types, account_names):
+    if isinstance(account_types, str):
+        account_types = [account_types]
+    if isinstance(account_names, str):
+        account_names = [account_names]
+    return tuple(sorted(set(account_types or []))), tuple(sorted(set(account_names or [])))
+
+## Compact, pre-sorted account balances - series codes, years and values as small typed numpy arrays
+class AccountBalances:
+
+    def __init__(self, type_names, account_names, series_types, series_names, years, balances, transactions, changes):
+        self.type_names = type_names  ## Account types in display order - series_types are indexes into this
+        self.account_names = account_names  ## Every account name, sorted - series_names are indexes into this
+        self.series_types = series_types
+        self.series_names = series_names
+        self.years = years
+        self.balances = balances  ## End of year balances, milliunits (series x years)
+        self.transactions = transactions  ## Transaction counts (series x years)
+        self.changes = changes  ## Changes in balance, milliunits (series x years)
+        self.type_codes = {type_name: code for code, type_name in enumerate(type_names)}
+        self.name_codes = {account_name: code for code, account_name in enumerate(account_names)}
+        bounds = np.searchsorted(series_types, np.arange(len(type_names) + 1))
+        self.type_rows = {type_name: slice(bounds[code], bounds[code + 1]) for code, type_name in enumerate(type_names)}
+
+    ## Build the table from the long account_balances frame (one row per type/name/year, dollars as floats). Account
+    ## types are ordered as in type_order, with any it doesn't list after them in name order.
+    @classmethod
+    def from_frame(cls, df_account_balances, type_order=()):
+        types = df_account_balances['account_type'].astype(str).to_numpy()
+        names = df_account_balances['account_name'].astype(str).to_numpy()
+        present = set(types)
+        type_names = [type_name for type_name in type_order if type_name in present] + sorted(present - set(type_order))
+        account_names = sorted(set(names))
+        years = np.unique(df_account_balances['year'].to_numpy()).astype(np.int16)
+
+        ## Number the series by (type, name) - np.unique sorts the combined codes, which sorts the series too
+        type_codes = pd.Categorical(types, categories=type_names).codes
+        name_codes = pd.Categorical(names, categories=account_names).codes
+        series_keys, series_index = np.unique(type_codes.astype(np.int64) * max(len(account_names), 1) + name_codes, return_inverse=True)
+        year_index = np.searchsorted(years, df_account_balances['year'].to_numpy())
+
+        ## Lay the values out as series x years grids, with any year a series doesn't have left at zero (and two accounts
+        ## sharing a name and type added together, as selecting by name always has)
+        grids = []
+        for column, dtype, scale in [('end_of_year_balance', np.int64, 1000), ('number_of_transactions', np.int32, 1), ('change_in_balance', np.int64, 1000)]:
+            grid = np.zeros((len(series_keys), len(years)), dtype=dtype)
+            np.add.at(grid, (series_index, year_index), np.round(df_account_balances[column].to_numpy() * scale).astype(dtype))
+            grids.append(grid)
+        return cls(
+            type_names, account_names,
+            (series_keys // max(len(account_names), 1)).astype(np.int16), (series_keys % max(len(account_names), 1)).astype(np.int32),
+            years, *grids
+        )
+
+    ## Lay the table back out as the long frame, optionally only for some years
+    def to_frame(self, years=None):
+        year_columns = np.flatnonzero(np.isin(self.years, list(years))) if years is not None else np.arange(len(self.years))
+        n_series, n_years = len(self.series_types), len(year_columns)
+        return pd.DataFrame({
+            'account_type': np.asarray(self.type_names, dtype=object)[np.repeat(self.series_types, n_years)],
+            'account_name': np.asarray(self.account_names, dtype=object)[np.repeat(self.series_names, n_years)],
+            'year': np.tile(self.years[year_columns].astype(int), n_series),
+            'end_of_year_balance': self.balances[:, year_columns].reshape(-1) / 1000,
+            'number_of_transactions': self.transactions[:, year_columns].reshape(-1).astype(np.int64),
+            'change_in_balance': self.changes[:, year_columns].reshape(-1) / 1000,
+        })
+
+    ## Rows for the selected account types and names (all accounts of those types if no names are selected) - a list
+    ## of slices when only types are picked, otherwise an array of row numbers
+    def select(self, account_types, account_names=()):
+        slices = [self.type_rows[type_name] for type_name in account_types if type_name in self.type_rows]
+        if not account_names:
+            return slices
+        rows = np.concatenate([np.arange(rows.start, rows.stop) for rows in slices]) if slices else np.empty(0, dtype=np.intp)
+        name_codes = [self.name_codes[account_name] for account_name in account_names if account_name in self.name_codes]
+        return rows[np.isin(self.series_names[rows], name_codes)]
+
+    ## Account names for the selected account types, in table order without repeats
+    def names_for_types(self, account_types):
+        codes = [self.series_names[rows] for rows in self.select(account_types)]
+        return [self.account_names[code] for code in dict.fromkeys(np.concatenate(codes).tolist())] if codes else []
+
+    ## Approximate memory held by the table, names included
+    @property
+    def nbytes(self):
+        arrays = [self.series_types, self.series_names, self.years, self.balances, self.transactions, self.changes]
+        return sum(array.nbytes for array in arrays) + sum(sys.getsizeof(name) for name in self.type_names + self.account_names)
+
+## Function to total the selected accounts' balances, transactions and changes by year (no rows if nothing is selected)
+def compute_year_totals(account_balances, account_types, account_names):
+    rows = account_balances.select(account_types, account_names)
+    if isinstance(rows, list):
+        if not any(block.stop > block.start for block in rows):
+            return pd.DataFrame(columns=['year', 'end_of_year_balance', 'number_of_transactions', 'change_in_balance'])
+        column_sum = lambda grid: sum(grid[block].sum(axis=0, dtype=np.int64) for block in rows)  ## Slices are views - nothing is copied
+    else:
+        if len(rows) == 0:
+            return pd.DataFrame(columns=['year', 'end_of_year_balance', 'number_of_transactions', 'change_in_balance'])
+        column_sum = lambda grid: grid[rows].sum(axis=0, dtype=np.int64)
+    return pd.DataFrame({
+        'year': account_balances.years.astype(np.int64),
+        'end_of_year_balance': column_sum(account_balances.balances) / 1000,
+        'number_of_transactions': column_sum(account_balances.transactions),
+        'change_in_balance': column_sum(account_balances.changes) / 1000,
+    })
+
+## LRU cache of per-year totals, safe to share between the app's request threads
+class AggregationCache:
+
+    def __init__(self, max_entries=AGGREGATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    ## Per-year totals for a selection of one budget's accounts. The returned frame is shared, so copy it before changing it.
+    def year_totals(self, budget_id, version, account_balances, account_types, account_names):
+        account_types, account_names = normalize_selection(account_types, account_names)
+        key = (budget_id, version, account_types, account_names)
+        with self.lock:
+
+            ## The budget's outputs have been rewritten - drop everything computed from the old ones
+            if self.versions.get(budget_id) != version:
+                for stale_key in [entry_key for entry_key in self.entries if entry_key[0] == budget_id]:
+                    del self.entries[stale_key]
+                self.versions[budget_id] = version
+
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        ## Compute outside the lock so other selections aren't held up - at worst two threads compute the same thing once
+        totals = compute_year_totals(account_balances, account_types, account_names)
+        with self.lock:
+            if self.versions.get(budget_id) == version:
+                self.entries[key] = totals
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return totals
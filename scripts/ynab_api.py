@@ -0,0 +1,230 @@
+#####################
+## YNAB API Client ##
+#####################
+
+## Import packages
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+import threading
+import random
+import time
+import io
+import os
+import ynab_cache
+from ynab_metrics import metrics
+
+## YNAB allows 200 requests per access token per rolling hour and reports usage on every response in the
+## X-Rate-Limit header (e.g. "36/200"). We keep a small reserve so a second process (or the Dash app) isn't locked out.
+RATE_LIMIT = 200
+RATE_LIMIT_WINDOW = 3600
+RATE_LIMIT_RESERVE = 5
+
+## Retry transient failures with exponential backoff plus full jitter
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+
+## Responses can be cached on disk (see ResponseCache), each endpoint for as long as its TTL in seconds allows - override
+## with e.g. HTTP_CACHE_TTLS=accounts=60,transactions=0. Endpoints without a TTL aren't cached. The cache is trimmed to
+## HTTP_CACHE_MAX_MB, least recently used first.
+HTTP_CACHE_TTLS = {'budgets': 86400, 'accounts': 3600, 'transactions': 3600, 'account_transactions': 3600}
+HTTP_CACHE_TTLS.update({
+    endpoint.strip(): float(ttl) for endpoint, ttl in
+    (item.split('=') for item in os.getenv('HTTP_CACHE_TTLS', '').split(',') if '=' in item)
+})
+HTTP_CACHE_MAX_MB = float(os.getenv('HTTP_CACHE_MAX_MB', '512'))
+HTTP_CACHE_HEADERS = ['Content-Type', 'X-Rate-Limit']
+
+
+######################
+## Define Functions ##
+######################
+
+## Rate limiter shared by every thread using the session. It tracks our own requests over the rolling window and also
+## trusts whatever the server says we've used, since other clients may be spending the same token.
+class RateLimiter:
+
+    def __init__(self, limit=RATE_LIMIT, window=RATE_LIMIT_WINDOW, reserve=RATE_LIMIT_RESERVE):
+        self.limit = limit - reserve
+        self.window = window
+        self.sent = deque()
+        self.server_used = 0
+        self.lock = threading.Lock()
+
+    ## Block until there's room in the window for one more request
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= self.window:
+                    self.sent.popleft()
+                if max(len(self.sent), self.server_used) < self.limit:
+                    self.sent.append(now)
+                    self.server_used += 1
+                    return
+                ## Wait for the oldest request we know about to age out (or a full window if it was someone else's)
+                wait = self.window - (now - self.sent[0]) if self.sent else self.window
+                self.server_used = len(self.sent)
+            print(f"Rate limit reached, waiting {wait:.0f}s before the next request.")
+            time.sleep(wait)
+
+    ## Update from the X-Rate-Limit header of a response (passed as the header value, so this also works through a
+    ## multiprocessing proxy when the limiter is shared between processes)
+    def update(self, header):
+        if header and '/' in header:
+            used, limit = header.split('/')
+            with self.lock:
+                self.server_used = int(used)
+                self.limit = min(self.limit, int(limit) - RATE_LIMIT_RESERVE)
+
+    ## Requests left before we start holding back
+    def remaining(self):
+        with self.lock:
+            return self.limit - max(len(self.sent), self.server_used)
+
+## The rate limiter this process should use. Batch runs install one shared by every process (see ynab_wrapped_batch.py),
+## otherwise each run gets its own.
+shared_rate_limiter = None
+
+## Function to install a rate limiter shared with other processes
+def use_shared_rate_limiter(limiter):
+    global shared_rate_limiter
+    shared_rate_limiter = limiter
+
+## Function to get the rate limiter for a run
+def get_rate_limiter():
+    return shared_rate_limiter if shared_rate_limiter is not None else RateLimiter()
+
+## Cache of API responses on disk, keyed by the request (url and query parameters), so it can be shared by every
+## process. In 'cache' mode a stored response is reused while it's younger than its endpoint's TTL; 'record' always
+## goes to the API and stores every response; 'replay' only ever serves stored responses, so a recorded run can be
+## repeated offline (delta requests only match when the store is in the same state, e.g. recorded and replayed with
+## FULL_REFRESH=true).
+class ResponseCache:
+
+    def __init__(self, directory, mode='cache', ttls=HTTP_CACHE_TTLS, max_bytes=int(HTTP_CACHE_MAX_MB * 1024 ** 2)):
+        if mode not in ('cache', 'record', 'replay'):
+            raise ValueError(f"Unknown HTTP cache mode '{mode}' - use cache, record or replay.")
+        self.entries = ynab_cache.DiskCache(directory, max_bytes)
+        self.mode = mode
+        self.ttls = ttls
+
+    def key(self, url, params):
+        return ynab_cache.make_key('GET', url, sorted((params or {}).items()))
+
+    ## The stored response for a request, or None if there isn't one that can be used
+    def get(self, url, params):
+        if self.mode == 'record':
+            return None
+        entry = self.entries.get(self.key(url, params), None)
+        if entry is None:
+            if self.mode == 'replay':
+                raise RuntimeError(f"No recorded response for {url} with {params or 'no parameters'} - record one first with HTTP_CACHE=record.")
+            return None
+        if self.mode == 'cache' and time.time() - entry['stored_at'] > self.ttls.get(endpoint_label(url), 0):
+            return None
+        return cached_response(url, entry)
+
+    ## Store a successful response, returning one to use in its place - the body has to be read in full to store it, so
+    ## the original can't be streamed any more
+    def put(self, url, params, response):
+        if self.mode == 'cache' and self.ttls.get(endpoint_label(url), 0) <= 0:
+            return response
+        entry = {
+            'stored_at': time.time(),
+            'headers': {name: response.headers[name] for name in HTTP_CACHE_HEADERS if name in response.headers},
+            'body': response.content,
+        }
+        self.entries.set(self.key(url, params), entry)
+        return cached_response(url, entry)
+
+## Function to rebuild a response from a cache entry - the body is readable both as .content and as a stream from .raw
+def cached_response(url, entry):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers.update(entry['headers'])
+    response._content = entry['body']
+    response.raw = io.BytesIO(entry['body'])
+    return response
+
+## The response cache this process should use, if any
+response_cache = None
+
+## Function to install a response cache for every request this process makes
+def use_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+## Function to build a keep-alive session with a connection pool big enough for every worker
+def make_session(api_key, workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    })
+    return session
+
+## Function to label a url by the kind of endpoint it hits, without the budget and account ids
+def endpoint_label(url):
+    path = url.split('?')[0].rstrip('/')
+    if path.endswith('/transactions') and '/accounts/' in path:
+        return 'account_transactions'
+    return path.rsplit('/', 1)[-1]
+
+## Function to GET a url, retrying transient errors and respecting the rate limit. With stream=True the body is left
+## unread so the caller can parse it as it arrives (and must close the response when done).
+def get_response(session, limiter, url, params=None, stream=False):
+    endpoint = endpoint_label(url)
+    cache = response_cache
+    if cache is not None:
+        cached = cache.get(url, params)
+        metrics.increment('http_cache_requests_total', endpoint=endpoint, result='miss' if cached is None else 'hit')
+        if cached is not None:
+            return cached
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=60, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            metrics.increment('http_requests_total', endpoint=endpoint, status='error')
+            if attempt == MAX_RETRIES:
+                raise
+            metrics.increment('http_retries_total', endpoint=endpoint, reason=type(error).__name__)
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+            continue
+        limiter.update(response.headers.get('X-Rate-Limit'))
+        metrics.increment('http_requests_total', endpoint=endpoint, status=str(response.status_code))
+        metrics.gauge('rate_limit_remaining', limiter.remaining())
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            ## Honour Retry-After when the server sends one, otherwise back off with jitter
+            retry_after = response.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            print(f"Got {response.status_code} from {url}, retrying in {delay:.1f}s.")
+            metrics.increment('http_retries_total', endpoint=endpoint, reason=str(response.status_code))
+            response.close()
+            time.sleep(delay)
+            continue
+        response.raise_for_status()  ## Raise error for bad status codes
+        if cache is not None:
+            return cache.put(url, params, response)
+        return response
+
+## Function to GET a url and return the parsed 'data' payload
+def get_data(session, limiter, url, params=None):
+    response = get_response(session, limiter, url, params=params)
+    metrics.increment('http_bytes_downloaded_total', len(response.content), endpoint=endpoint_label(url))
+    return response.json()['data']
+
+## Function to run fetch_function over every item on a thread pool, yielding (item, result) pairs as they finish
+def fetch_all(fetch_function, items, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_function, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
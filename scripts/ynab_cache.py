@@ -0,0 +1,104 @@
+###########
+## Cache ##
+###########
+
+## Import packages
+import functools
+import hashlib
+import json
+import os
+import pickle
+
+## A content-addressed cache on disk. Each entry is a pickle file named by the sha256 of its key, written under a
+## temporary name and moved into place, so any number of processes can share one directory safely. Reading an entry
+## touches it, and once the directory grows past its size limit the least recently used entries are removed.
+
+## How many writes go by between size checks
+EVICT_EVERY = 50
+
+## Returned by get when there's no entry, since None is a value worth caching
+MISSING = object()
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to build a cache key from anything JSON can describe
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+## Size-limited cache of pickled values in a directory shared between processes
+class DiskCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.writes_since_evict = 0
+        os.makedirs(directory, exist_ok=True)
+
+    ## Entries are spread over 256 subfolders so no one folder gets huge
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, default=MISSING):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        try:
+            os.utime(path)  ## Mark it recently used
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.writes_since_evict += 1
+        if self.writes_since_evict >= EVICT_EVERY:
+            self.evict()
+
+    ## Remove the least recently used entries until the cache fits in max_bytes again
+    def evict(self):
+        self.writes_since_evict = 0
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue  ## Another process got to it first
+                entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(root, name)))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    ## Decorator caching a function's results by its name, its arguments and version_function() - whatever the result
+    ## depends on besides the arguments (e.g. which data snapshot is loaded), so a new version never hits old entries
+    def memoize(self, version_function):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args):
+                key = make_key(function.__name__, version_function(), *args)
+                value = self.get(key)
+                if value is MISSING:
+                    value = function(*args)
+                    self.set(key, value)
+                return value
+            return wrapper
+        return decorator
@@ -0,0 +1,135 @@
+##################
+## Calculations ##
+##################
+
+## Import packages
+import hashlib
+import numpy as np
+import pandas as pd
+
+## Balances for every account in one pass: each transaction date is parsed once and dropped into an (account, month)
+## bucket. Months roll up into years, year-end balances fall out of a cumulative sum across the years, and running totals
+## across the months turn any date range into two lookups per account. This replaces re-filtering the whole
+## transaction list for every account and every year.
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to turn 'YYYY-MM-DD' strings into months counted from January of first_year, parsing each date exactly once
+def parse_months(dates, first_year):
+    days = np.asarray(dates, dtype='datetime64[D]')
+    return days.astype('datetime64[M]').astype(np.int64) - (first_year - 1970) * 12
+
+## Function to calculate the net flow and number of transactions per account per month
+## account_codes are integers 0..n_accounts-1 saying which account each transaction belongs to; amounts are milliunits.
+## Transactions outside years_range are ignored, matching the old "2022-01-01 to {year}-12-31" windows.
+def month_buckets(account_codes, dates, amounts, n_accounts, years_range):
+    n_months = len(years_range) * 12
+    months = parse_months(dates, years_range[0])
+    in_range = (months >= 0) & (months < n_months)
+    buckets = np.asarray(account_codes, dtype=np.int64)[in_range] * n_months + months[in_range]
+    ## Weighted bincount sums in float64, which is exact for integer milliunits well past any realistic balance
+    net_flow = np.bincount(buckets, weights=np.asarray(amounts, dtype=np.int64)[in_range], minlength=n_accounts * n_months)
+    counts = np.bincount(buckets, minlength=n_accounts * n_months)
+    return np.rint(net_flow).astype(np.int64).reshape(n_accounts, n_months), counts.reshape(n_accounts, n_months)
+
+## Function to read (account_id, date, amount, id) rows straight into numpy columns, with no list of tuples in between.
+## Ids come in as bytes and stay that way, so they sort and hash as they are.
+def transaction_columns(rows):
+    table = np.fromiter(rows, dtype=[('account_id', object), ('date', 'S10'), ('amount', np.int64), ('id', object)])
+    return table['account_id'], table['date'], table['amount'], table['id'].astype('S')
+
+## The hash of an (account, year) with no transactions
+EMPTY_YEAR_HASH = hashlib.sha256(b'').hexdigest()
+
+## Function to turn fixed-width byte string ids into big-endian 64-bit words, most significant first - sorting on the
+## words sorts the ids, and integers sort far faster than byte strings
+def id_sort_keys(ids):
+    width = -(-max(ids.dtype.itemsize, 1) // 8) * 8
+    padded = np.zeros((len(ids), width), dtype=np.uint8)
+    padded[:, :ids.dtype.itemsize] = ids.view(np.uint8).reshape(len(ids), ids.dtype.itemsize)
+    words = padded.view('>u8')
+    return [words[:, column] for column in range(words.shape[1])]
+
+## Function to hash the transactions behind each (account, year) - sorted by account, year and id, laid out as fixed-width
+## records and hashed a group at a time, so any add, delete or change of date or amount changes the hash. Returns
+## {(account_code, year): hash} for every (account, year) that has transactions.
+def year_content_hashes(account_codes, dates, amounts, ids):
+    account_codes = np.asarray(account_codes, dtype=np.int64)
+    years = np.asarray(dates, dtype='datetime64[Y]').astype(np.int64) + 1970
+    ## Sort by id, then stably by (account, year) as one integer key - the same order as sorting on all three at once,
+    ## but the second sort moves one column rather than every id word
+    by_id = np.lexsort(id_sort_keys(ids)[::-1])
+    first_year = years.min() if len(years) else 0
+    groups = account_codes * (years.max() - first_year + 1 if len(years) else 1) + (years - first_year)
+    order = by_id[np.argsort(groups[by_id], kind='stable')]
+    records = np.empty(len(order), dtype=[('id', ids.dtype), ('date', 'S10'), ('amount', np.int64)])
+    records['id'], records['date'], records['amount'] = ids[order], np.asarray(dates, dtype='S10')[order], np.asarray(amounts)[order]
+    codes, years = account_codes[order], years[order]
+    bounds = np.flatnonzero((np.diff(codes) != 0) | (np.diff(years) != 0)) + 1
+    starts, ends = np.r_[0, bounds], np.r_[bounds, len(order)]
+    return {
+        (int(codes[start]), int(years[start])): hashlib.sha256(records[start:end].tobytes()).hexdigest()
+        for start, end in zip(starts, ends) if end > start
+    }
+
+## Function to roll monthly buckets up into calendar years
+def roll_up_years(month_net_flow, month_counts):
+    n_accounts = month_net_flow.shape[0]
+    return month_net_flow.reshape(n_accounts, -1, 12).sum(axis=2), month_counts.reshape(n_accounts, -1, 12).sum(axis=2)
+
+## Function to turn yearly buckets into end of year balances, transaction counts and changes in balance
+## Returns three (n_accounts, n_years) arrays - balances and changes in dollars, counts as ints.
+def year_end_from_buckets(net_flow, counts):
+    balances = np.cumsum(net_flow, axis=1)
+    ## The first year has nothing to compare against, so its change is zero (as it's always been in the outputs)
+    changes = net_flow.copy()
+    changes[:, 0] = 0
+    return balances / 1000, counts, changes / 1000
+
+## Function to total a range of months for a set of rows straight from running totals, so they can be used in place -
+## e.g. memory-mapped from the month cube file. Two lookups per row, however long the range.
+def running_range_total(running, rows, start_month, end_month):
+    before = running[rows, start_month - 1].sum() if start_month > 0 else 0
+    return running[rows, end_month].sum() - before
+
+## Function to lay the per-account results out as the account_balances table, one row per group/account/year
+def build_account_balances(account_groupings, account_codes_by_id, account_names, balances, counts, changes, years_range):
+    group_names, codes = [], []
+    for group_name, account_ids in account_groupings.items():
+        for account_id in account_ids:
+            group_names.append(group_name)
+            codes.append(account_codes_by_id[account_id])
+    n_years = len(years_range)
+    year_offsets = np.tile(np.arange(n_years), len(codes))
+    cells = np.repeat(np.asarray(codes, dtype=np.int64), n_years) * n_years + year_offsets
+    return pd.DataFrame({
+        'account_type': np.repeat(np.asarray(group_names, dtype=object), n_years),
+        'account_name': np.asarray(account_names, dtype=object)[cells // n_years],
+        'year': years_range[0] + year_offsets,
+        'end_of_year_balance': balances.reshape(-1)[cells],
+        'number_of_transactions': counts.reshape(-1)[cells],
+        'change_in_balance': changes.reshape(-1)[cells],
+    })
+
+## Function to lay the monthly cube out as a table, one row per group/account/month, with its running totals alongside
+def build_account_months(account_groupings, account_codes_by_id, account_names, month_net_flow, month_counts, years_range):
+    group_names, codes = [], []
+    for group_name, account_ids in account_groupings.items():
+        for account_id in account_ids:
+            group_names.append(group_name)
+            codes.append(account_codes_by_id[account_id])
+    n_months = month_net_flow.shape[1]
+    month_offsets = np.tile(np.arange(n_months), len(codes))
+    cells = np.repeat(np.asarray(codes, dtype=np.int64), n_months) * n_months + month_offsets
+    return pd.DataFrame({
+        'account_type': np.repeat(np.asarray(group_names, dtype=object), n_months),
+        'account_name': np.asarray(account_names, dtype=object)[cells // n_months],
+        'month': np.datetime64(f"{years_range[0]}-01", 'M') + month_offsets,
+        'net_flow': month_net_flow.reshape(-1)[cells],
+        'number_of_transactions': month_counts.reshape(-1)[cells],
+        'cumulative_net_flow': np.cumsum(month_net_flow, axis=1).reshape(-1)[cells],
+        'cumulative_transactions': np.cumsum(month_counts, axis=1).reshape(-1)[cells],
+    })
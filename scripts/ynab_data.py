@@ -0,0 +1,131 @@
+###################
+## Data Provider ##
+###################
+
+## Import packages
+import hashlib
+import threading
+import time
+import os
+import numpy as np
+import pandas as pd
+import account_groupings
+import ynab_aggregations
+import ynab_outputs
+
+## The Dash app reads its data through a provider rather than loading it once at import. A background thread checks the
+## backend's outputs every DATA_RELOAD_INTERVAL seconds and, when something has been rewritten, loads a new snapshot
+## (re-reading only the years whose files changed) and swaps it in whole. Callbacks take the current snapshot once and
+## use only that, so a request never sees half of one refresh and half of the next.
+##
+## The month cube's running totals are used straight from the memory-mapped file rather than copied, so when the app
+## runs as several worker processes they all share one copy of it through the page cache.
+DATA_RELOAD_INTERVAL = float(os.getenv('DATA_RELOAD_INTERVAL', '5'))
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to load one budget's data. Given the previous load, year files that haven't changed are reused from it.
+def load_budget(budget_dir, previous=None):
+    version = ynab_outputs.outputs_version(budget_dir)
+    balances_dir = f'{budget_dir}/account_balances'
+
+    ## Account balances (one memory-mapped Arrow file per year, written by the backend) - only changed years are read,
+    ## and the rest come out of the previous load. Either way they're kept as a compact AccountBalances table, with
+    ## account types in the order account_groupings.json lists them.
+    stamps = ynab_outputs.partition_stamps(balances_dir)
+    if previous is None:
+        df_account_balances = ynab_outputs.read_account_balances(balances_dir)
+    else:
+        unchanged = [year for year, stamp in stamps.items() if previous['partition_stamps'].get(year) == stamp]
+        changed = [year for year in stamps if year not in unchanged]
+        df_account_balances = pd.concat([
+            previous['account_balances'].to_frame(years=unchanged),
+            ynab_outputs.read_account_balances(balances_dir, years=changed)
+        ], ignore_index=True)
+    account_balances = ynab_aggregations.AccountBalances.from_frame(df_account_balances, account_groupings.group_names())
+
+    ## The account x month cube, with its running totals laid out as one row per account so any range of months is two
+    ## lookups per row. The backend writes each account's months as one block, so rows are keyed by position rather
+    ## than by (account_type, account_name) - two accounts sharing a name and type stay two rows, and selecting that
+    ## name sums both, as the account balances do.
+    table_account_months = ynab_outputs.read_account_months_table(
+        f'{budget_dir}/account_months.arrow',
+        columns=['account_type', 'account_name', 'month', 'cumulative_net_flow', 'cumulative_transactions']
+    )
+    cube_months = pd.to_datetime(table_account_months.column('month').unique().to_pandas().sort_values()).reset_index(drop=True)
+    cube_rows = table_account_months.select(['account_type', 'account_name']).take(np.arange(0, table_account_months.num_rows, max(len(cube_months), 1))).to_pandas()
+
+    return {
+        'version': version,
+        'partition_stamps': stamps,
+        'account_balances': account_balances,
+        'account_types': account_balances.type_names,
+        'cube_months': cube_months,
+        'cube_rows': cube_rows,
+        'cube_balance_running': mapped_column(table_account_months, 'cumulative_net_flow').reshape(len(cube_rows), len(cube_months)),
+        'cube_transactions_running': mapped_column(table_account_months, 'cumulative_transactions').reshape(len(cube_rows), len(cube_months)),
+    }
+
+## Function to get a numeric column of a memory-mapped table as a numpy array, without copying it when it's one chunk
+def mapped_column(table, column):
+    chunks = table.column(column).chunks
+    if len(chunks) == 1:
+        return chunks[0].to_numpy(zero_copy_only=True)
+    return np.concatenate([chunk.to_numpy() for chunk in chunks])  ## Cubes written before they were a single batch
+
+## Function to get a version for a set of budgets - the same in every process that has loaded the same outputs
+def snapshot_version(budgets, budget_names):
+    return hashlib.sha256(repr(sorted((budget_id, budget['version'], budget_names[budget_id]) for budget_id, budget in budgets.items())).encode()).hexdigest()[:16]
+
+## Everything the app shows at one point in time - every budget's data and their names. Never changed once built.
+class Snapshot:
+
+    def __init__(self, version, budgets, budget_names):
+        self.version = version
+        self.budgets = budgets
+        self.budget_names = budget_names
+
+## Keeps the current snapshot of the backend's outputs, refreshing it in the background
+class DataProvider:
+
+    def __init__(self, budgets_dir, interval=DATA_RELOAD_INTERVAL):
+        self.budgets_dir = budgets_dir
+        self.interval = interval
+        self.refresh_lock = threading.Lock()
+        self.snapshot = Snapshot(None, {}, {})
+        self.refresh()
+
+    ## Load whatever has changed since the last snapshot and swap the new one in, returning whether anything changed
+    def refresh(self):
+        with self.refresh_lock:
+            current = self.snapshot
+            budget_names = ynab_outputs.list_budgets(self.budgets_dir)
+            budgets = {}
+            for budget_id in budget_names:
+                previous = current.budgets.get(budget_id)
+                budget_dir = f'{self.budgets_dir}/{budget_id}'
+                if previous is not None and ynab_outputs.outputs_version(budget_dir) == previous['version']:
+                    budgets[budget_id] = previous
+                else:
+                    budgets[budget_id] = load_budget(budget_dir, previous)
+            if budget_names == current.budget_names and all(budgets[budget_id] is current.budgets.get(budget_id) for budget_id in budgets):
+                return False
+            self.snapshot = Snapshot(snapshot_version(budgets, budget_names), budgets, budget_names)
+            return True
+
+    ## Keep refreshing in a background thread. A failed refresh (say, the backend is mid-write) leaves the current
+    ## snapshot in place and is tried again next time.
+    def start(self):
+        def watch():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    if self.refresh():
+                        print(f"Reloaded data (snapshot {self.snapshot.version}).")
+                except Exception as error:
+                    print(f"Couldn't reload data, keeping the current snapshot - {type(error).__name__}: {error}")
+        threading.Thread(target=watch, name='data-provider', daemon=True).start()
+        return self
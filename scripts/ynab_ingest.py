@@ -0,0 +1,110 @@
+###########################
+## Transaction Ingestion ##
+###########################
+
+## Import packages
+from array import array
+from datetime import date
+from ynab_metrics import metrics
+
+## ijson lets us parse the transactions array as it comes off the wire rather than holding the raw body and the whole
+## parsed object tree in memory at once. Without it we fall back to response.json(), which gives the same result.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+## Only these fields of each transaction are kept
+TRANSACTION_PREFIX = 'data.transactions.item'
+TRANSACTION_FIELDS = {'id', 'account_id', 'date', 'amount', 'deleted', 'payee_name', 'category_name', 'memo'}
+
+
+######################
+## Define Functions ##
+######################
+
+## Compact, column-oriented buffer of transactions - amounts as int64 milliunits, dates as day ordinals and accounts as
+## small integer codes into account_ids. Ids are kept as strings since the store is keyed on them, and payee, category
+## and memo (any of which can be missing) as strings for the drill-down.
+class TransactionColumns:
+
+    def __init__(self):
+        self.ids = []
+        self.account_ids = []
+        self.account_codes_by_id = {}
+        self.account_codes = array('i')
+        self.date_ordinals = array('i')
+        self.amounts = array('q')
+        self.deleted = array('b')
+        self.payee_names = []
+        self.category_names = []
+        self.memos = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    ## Add one transaction
+    def append(self, tx_id, account_id, tx_date, amount, deleted, payee_name=None, category_name=None, memo=None):
+        code = self.account_codes_by_id.get(account_id)
+        if code is None:
+            code = self.account_codes_by_id[account_id] = len(self.account_ids)
+            self.account_ids.append(account_id)
+        self.ids.append(tx_id)
+        self.account_codes.append(code)
+        self.date_ordinals.append(date.fromisoformat(tx_date).toordinal())
+        self.amounts.append(int(amount))
+        self.deleted.append(1 if deleted else 0)
+        self.payee_names.append(payee_name)
+        self.category_names.append(category_name)
+        self.memos.append(memo)
+
+    ## Yield (id, account_id, 'YYYY-MM-DD', amount, deleted, payee_name, category_name, memo) rows, one at a time
+    def rows(self):
+        columns = zip(self.ids, self.account_codes, self.date_ordinals, self.amounts, self.deleted, self.payee_names, self.category_names, self.memos)
+        for tx_id, code, ordinal, amount, deleted, payee_name, category_name, memo in columns:
+            yield tx_id, self.account_ids[code], date.fromordinal(ordinal).isoformat(), amount, bool(deleted), payee_name, category_name, memo
+
+## File-like wrapper around the raw response that counts the bytes read through it
+class CountingReader:
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+## Function to read a transactions response into column buffers, returning the buffers and the server_knowledge
+def read_transactions(response, endpoint='transactions'):
+    columns = TransactionColumns()
+    server_knowledge = None
+
+    ## No ijson - parse the whole body, but still only keep the compact columns
+    if ijson is None:
+        metrics.increment('http_bytes_downloaded_total', len(response.content), endpoint=endpoint)
+        data = response.json()['data']
+        for tx in data['transactions']:
+            columns.append(tx['id'], tx['account_id'], tx['date'], tx['amount'], tx.get('deleted', False), tx.get('payee_name'), tx.get('category_name'), tx.get('memo'))
+        return columns, data['server_knowledge']
+
+    ## Walk the parse events, collecting the fields we want for the current transaction and flushing it when its object ends
+    response.raw.decode_content = True
+    reader = CountingReader(response.raw)
+    current = {}
+    for prefix, event, value in ijson.parse(reader, use_float=True):
+        if prefix.startswith(TRANSACTION_PREFIX + '.'):
+            field = prefix[len(TRANSACTION_PREFIX) + 1:]
+            if field in TRANSACTION_FIELDS and event in ('string', 'number', 'boolean'):
+                current[field] = value
+        elif prefix == TRANSACTION_PREFIX and event == 'end_map':
+            columns.append(
+                current['id'], current['account_id'], current['date'], current['amount'], current.get('deleted', False),
+                current.get('payee_name'), current.get('category_name'), current.get('memo')
+            )
+            current = {}
+        elif prefix == 'data.server_knowledge' and event == 'number':
+            server_knowledge = int(value)
+    metrics.increment('http_bytes_downloaded_total', reader.bytes_read, endpoint=endpoint)
+    return columns, server_knowledge
@@ -0,0 +1,126 @@
+#############
+## Metrics ##
+#############
+
+## Import packages
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+
+## Every timer, counter and gauge is appended to a JSON-lines file as it happens (one object per line, tagged with the
+## run id), and a Prometheus text-format snapshot of the totals can be written at the end of the run for a textfile
+## collector to pick up. Both are optional - with no paths configured, metrics are only kept in memory.
+
+
+######################
+## Define Functions ##
+######################
+
+## Collects metrics for one run. Safe to use from the fetch workers.
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jsonl_path = None
+        self.prometheus_path = None
+        self.labels = {}
+        self.run_id = uuid.uuid4().hex[:12]
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.stage_started = time.perf_counter()
+        self.stage_requests = 0
+
+    ## Start a new run - where to write metrics, and labels to put on every one (e.g. the budget id). Totals from any
+    ## earlier run in the same process (batch workers run several budgets each) are dropped.
+    def configure(self, jsonl_path=None, prometheus_path=None, **labels):
+        with self.lock:
+            self.jsonl_path = jsonl_path
+            self.prometheus_path = prometheus_path
+            self.labels = labels
+            self.run_id = uuid.uuid4().hex[:12]
+            self.counters, self.gauges, self.timers = {}, {}, {}
+            self.stage_started = time.perf_counter()
+            self.stage_requests = 0
+        if jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+
+    ## Record one event, updating the in-memory totals and appending it to the JSON-lines file
+    def record(self, kind, name, value, labels, extra=None):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if kind == 'counter':
+                self.counters[key] = self.counters.get(key, 0) + value
+            elif kind == 'gauge':
+                self.gauges[key] = value
+            else:
+                count, total = self.timers.get(key, (0, 0.0))
+                self.timers[key] = (count + 1, total + value)
+            if self.jsonl_path:
+                event = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'run_id': self.run_id, 'type': kind, 'name': name, 'value': value, 'labels': {**self.labels, **labels}}
+                with open(self.jsonl_path, 'a') as f:
+                    f.write(json.dumps({**event, **(extra or {})}) + '\n')
+
+    def increment(self, name, value=1, **labels):
+        self.record('counter', name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        self.record('gauge', name, value, labels)
+
+    ## Time the block inside the with statement
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record('timer', name, time.perf_counter() - started, labels)
+
+    ## Total of a counter across all its labels
+    def counter_total(self, name):
+        with self.lock:
+            return sum(value for (counter_name, _), value in self.counters.items() if counter_name == name)
+
+    ## Mark the end of a pipeline stage - records how long it took since the previous stage ended, how many requests it
+    ## made and the peak memory so far
+    def end_stage(self, stage):
+        requests = self.counter_total('http_requests_total')
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)  ## bytes on macOS, KB on Linux
+        self.record('timer', 'stage_seconds', time.perf_counter() - self.stage_started, {'stage': stage}, {'requests': requests - self.stage_requests, 'peak_rss_mb': peak_rss_mb})
+        self.gauge('peak_rss_megabytes', peak_rss_mb)
+        self.stage_started, self.stage_requests = time.perf_counter(), requests
+
+    ## Write the totals in Prometheus text format (timers as summaries), if a path was configured
+    def write_prometheus(self):
+        if not self.prometheus_path:
+            return
+        lines = []
+        with self.lock:
+            series = [('counter', name, labels, value) for (name, labels), value in self.counters.items()]
+            series += [('gauge', name, labels, value) for (name, labels), value in self.gauges.items()]
+            series += [('summary', name, labels, value) for (name, labels), value in self.timers.items()]
+        typed = set()
+        for kind, name, labels, value in sorted(series, key=lambda s: (s[1], s[2])):
+            metric = f"ynab_wrapped_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} {kind}")
+                typed.add(metric)
+            label_text = ','.join(f'{key}="{value}"' for key, value in sorted({**self.labels, **dict(labels)}.items()))
+            if kind == 'summary':
+                lines.append(f"{metric}_count{{{label_text}}} {value[0]}")
+                lines.append(f"{metric}_sum{{{label_text}}} {value[1]}")
+            else:
+                lines.append(f"{metric}{{{label_text}}} {value}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.prometheus_path)), exist_ok=True)
+        with open(f"{self.prometheus_path}.tmp", 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f"{self.prometheus_path}.tmp", self.prometheus_path)
+
+## One collector per process, shared by every module
+metrics = Metrics()
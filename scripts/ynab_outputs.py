@@ -0,0 +1,203 @@
+#############
+## Outputs ##
+#############
+
+## Import packages
+import hashlib
+import json
+import os
+import shutil
+import pyarrow as pa
+import pyarrow.fs as fs
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+## Outputs are written as one file per year under hive-style year=YYYY folders, so readers can skip years they don't need
+## and years that are over only get rewritten when something in them changes. Account balances are small and read by the Dash app on every
+## start, so they're uncompressed Arrow IPC files the app can memory-map; transaction detail is larger and only read in
+## bulk, so it's zstd-compressed Parquet. pyarrow.dataset is only needed to read folders back, so the backend (which
+## only writes them) never imports it.
+
+## Explicit schemas, so nothing gets re-inferred on the way back in
+YEAR_PARTITIONING_SCHEMA = pa.schema([('year', pa.int16())])
+ACCOUNT_BALANCES_SCHEMA = pa.schema([
+    ('account_type', pa.dictionary(pa.int32(), pa.string())),
+    ('account_name', pa.dictionary(pa.int32(), pa.string())),
+    ('end_of_year_balance', pa.float64()),
+    ('number_of_transactions', pa.int64()),
+    ('change_in_balance', pa.float64()),
+])
+ACCOUNT_MONTHS_SCHEMA = pa.schema([
+    ('account_type', pa.dictionary(pa.int32(), pa.string())),
+    ('account_name', pa.dictionary(pa.int32(), pa.string())),
+    ('month', pa.date32()),
+    ('net_flow', pa.int64()),
+    ('number_of_transactions', pa.int64()),
+    ('cumulative_net_flow', pa.int64()),
+    ('cumulative_transactions', pa.int64()),
+])
+TRANSACTIONS_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('account_id', pa.dictionary(pa.int32(), pa.string())),
+    ('account_name', pa.dictionary(pa.int32(), pa.string())),
+    ('date', pa.date32()),
+    ('amount', pa.int64()),
+])
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to write one table per year under root/year=YYYY/. Years before open_year that already have a file are left
+## alone unless rewrite is set, or skip_unchanged is set and the new table differs from what's on disk.
+def write_by_year(df, root, schema, file_format, open_year, rewrite=False, skip_unchanged=False):
+    written = []
+    for year, year_df in df.groupby('year', sort=True):
+        path = year_path(root, year, file_format)
+        table = pa.Table.from_pandas(year_df.drop(columns='year'), schema=schema, preserve_index=False)
+        if year < open_year and os.path.exists(path) and not rewrite:
+            if not skip_unchanged or read_file(path, file_format).equals(table):
+                continue
+        write_year(table, root, year, file_format)
+        written.append(int(year))
+
+    ## Years that are no longer in the table at all (say, FIRST_YEAR has moved on) are removed rather than left to be served
+    for year in set(written_years(root)) - {int(year) for year in df['year'].unique()}:
+        remove_year(root, year)
+    return written
+
+## Function to get the path of one year's file under root
+def year_path(root, year, file_format):
+    return os.path.join(root, f"year={year}", f"part-0.{'arrow' if file_format == 'ipc' else 'parquet'}")
+
+## Function to write one year's table under root/year=YYYY/ - to a temporary name first and then moved into place, so
+## readers never see half a file
+def write_year(table, root, year, file_format):
+    path = year_path(root, year, file_format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if file_format == 'ipc':
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+    else:
+        pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+## Function to remove one year's folder under root - and root itself once no years are left, so an output with nothing in
+## it looks the same as one that was never written
+def remove_year(root, year):
+    shutil.rmtree(os.path.join(root, f"year={year}"), ignore_errors=True)
+    if os.path.isdir(root) and not os.listdir(root):
+        os.rmdir(root)
+
+## Function to read a single output file back as an Arrow table
+def read_file(path, file_format):
+    if file_format == 'ipc':
+        return feather.read_table(path, memory_map=True)
+    return pq.read_table(path)
+
+## Function to list the years that already have a file under root
+def written_years(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name.split('=')[1]) for name in os.listdir(root) if name.startswith('year='))
+
+## Function to write the account balances table
+## Past years are compared against what's on disk, since a backdated edit or a renamed account changes them
+def write_account_balances(df, root, open_year, rewrite=False):
+    return write_by_year(df, root, ACCOUNT_BALANCES_SCHEMA, 'ipc', open_year, rewrite, skip_unchanged=True)
+
+## Function to write one year of the per-transaction detail table, straight from its columns into Arrow
+def write_transactions_year(root, year, ids, account_ids, account_names, dates, amounts):
+    table = pa.table({
+        'id': pa.array(ids, pa.string()),
+        'account_id': pa.array(account_ids, pa.string()).dictionary_encode(),
+        'account_name': pa.array(account_names, pa.string()).dictionary_encode(),
+        'date': pa.array(dates, pa.string()).cast(pa.date32()),
+        'amount': pa.array(amounts, pa.int64()),
+    }, schema=TRANSACTIONS_SCHEMA)
+    write_year(table, root, year, 'parquet')
+
+## Function to write the account x month cube. It's small (accounts x months) and every month can shift when anything is
+## backdated, so it's written whole each run as a single memory-mappable Arrow file - one record batch, so each column
+## can be used straight from the mapped file without being copied.
+def write_account_months(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df, schema=ACCOUNT_MONTHS_SCHEMA, preserve_index=False)
+    feather.write_feather(table, f"{path}.tmp", compression='uncompressed', chunksize=max(len(table), 1))
+    os.replace(f"{path}.tmp", path)
+
+## Function to open the account x month cube as a memory-mapped Arrow table - nothing is read until it's used, and every
+## process mapping the same file shares the same pages
+def read_account_months_table(path, columns=None):
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+## Function to open a year-partitioned output folder as a dataset
+def open_dataset(root, file_format):
+    import pyarrow.dataset as ds
+    return ds.dataset(
+        root,
+        format='ipc' if file_format == 'ipc' else 'parquet',
+        partitioning=ds.partitioning(YEAR_PARTITIONING_SCHEMA, flavor='hive'),
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+        exclude_invalid_files=True
+    )
+
+## Function to read account balances into pandas, only touching the columns and years asked for
+def read_account_balances(root, columns=None, years=None):
+    import pyarrow.dataset as ds
+    dataset = open_dataset(root, 'ipc')
+    year_filter = ds.field('year').isin(list(years)) if years is not None else None
+    table = dataset.to_table(columns=columns, filter=year_filter)
+    df = table.to_pandas()
+    if 'year' in df.columns:
+        df['year'] = df['year'].astype(int)
+        df = df.sort_values('year', kind='stable').reset_index(drop=True)
+    return df
+
+## Function to record which budget a budget's output folder belongs to, so the Dash app can show its name
+def write_budget_info(budget_dir, budget_id, name=None):
+    os.makedirs(budget_dir, exist_ok=True)
+    path = f"{budget_dir}/budget.json"
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump({'id': budget_id, 'name': name or budget_id}, f)
+    os.replace(f"{path}.tmp", path)
+
+## Function to list the budgets with outputs under a folder, as {budget_id: name}, in name order
+def list_budgets(budgets_dir):
+    budgets = {}
+    if not os.path.isdir(budgets_dir):
+        return budgets
+    for budget_id in os.listdir(budgets_dir):
+        budget_dir = f"{budgets_dir}/{budget_id}"
+        if not os.path.isdir(f"{budget_dir}/account_balances"):
+            continue
+        try:
+            with open(f"{budget_dir}/budget.json") as f:
+                budgets[budget_id] = json.load(f)['name']
+        except (OSError, ValueError, KeyError):
+            budgets[budget_id] = budget_id
+    return dict(sorted(budgets.items(), key=lambda item: item[1].lower()))
+
+## Function to get a version stamp for a budget's app-facing outputs (account balances and the month cube) - changes
+## whenever the backend rewrites any of them, without reading them, and is the same in every process
+def outputs_version(budget_dir):
+    stamps = []
+    for root, _, files in os.walk(budget_dir):
+        if root.startswith(f"{budget_dir}/transactions"):
+            continue
+        for name in files:
+            if name.endswith('.arrow'):
+                stat = os.stat(f"{root}/{name}")
+                stamps.append((os.path.relpath(f"{root}/{name}", budget_dir), stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha256(repr(sorted(stamps)).encode()).hexdigest()[:16]
+
+## Function to stamp each year's file under root with its modification time and size, as {year: (mtime_ns, size)}
+def partition_stamps(root, file_format='ipc'):
+    stamps = {}
+    for year in written_years(root):
+        path = year_path(root, year, file_format)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamps[year] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
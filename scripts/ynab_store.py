@@ -0,0 +1,361 @@
+#############################
+## Local Transaction Store ##
+#############################
+
+## Import packages
+import sqlite3
+import json
+import os
+
+## The store is a single SQLite file per budget holding every account and transaction we've seen, plus the
+## server_knowledge YNAB handed back for each endpoint on the last sync. Passing that knowledge back as
+## last_knowledge_of_server means the API only returns what has changed since (including deletions).
+##
+## Each transaction keeps its payee, category and memo too, so the Dash app can page through them (indexed on date,
+## account and category) without anything being loaded whole.
+##
+## The Wrapped insights come from rollup tables - spend by month and category, by month and payee, and each year's
+## largest transactions - rebuilt a year at a time for just the years a merge touched.
+##
+## It also keeps a checkpoint per account per year - monthly net flow and transaction counts, plus a hash of the
+## transactions behind them. Every merge marks the (account, year) pairs it touched as dirty, so a run only has to
+## recompute the open year and whatever a backdated edit actually changed.
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to open (and create, if needed) the store for a budget
+def open_store(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            endpoint TEXT PRIMARY KEY,
+            server_knowledge INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS accounts (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id TEXT PRIMARY KEY,
+            account_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            payee_name TEXT,
+            category_name TEXT,
+            memo TEXT
+        );
+        CREATE TABLE IF NOT EXISTS dirty_years (
+            account_id TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            PRIMARY KEY (account_id, year)
+        );
+        CREATE TABLE IF NOT EXISTS year_checkpoints (
+            account_id TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            PRIMARY KEY (account_id, year)
+        );
+        CREATE TABLE IF NOT EXISTS month_checkpoints (
+            account_id TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            net_flow INTEGER NOT NULL,
+            number_of_transactions INTEGER NOT NULL,
+            PRIMARY KEY (account_id, year, month)
+        );
+        CREATE TABLE IF NOT EXISTS rollup_years (
+            year INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS category_months (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            category_name TEXT NOT NULL,
+            spend INTEGER NOT NULL,
+            number_of_transactions INTEGER NOT NULL,
+            PRIMARY KEY (year, month, category_name)
+        );
+        CREATE TABLE IF NOT EXISTS payee_months (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            payee_name TEXT NOT NULL,
+            spend INTEGER NOT NULL,
+            number_of_transactions INTEGER NOT NULL,
+            PRIMARY KEY (year, month, payee_name)
+        );
+        CREATE TABLE IF NOT EXISTS largest_transactions (
+            year INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            payee_name TEXT,
+            category_name TEXT,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (year, rank)
+        );
+    """)
+
+    ## Stores from before payee, category and memo were kept get the columns added, and are wiped so the next sync
+    ## downloads everything again and fills them in
+    transaction_columns = {name for _, name, *_ in conn.execute("PRAGMA table_info(transactions)")}
+    if 'payee_name' not in transaction_columns:
+        with conn:
+            for column in ('payee_name', 'category_name', 'memo'):
+                conn.execute(f"ALTER TABLE transactions ADD COLUMN {column} TEXT")
+        if conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] > 0:
+            print("Store predates payee, category and memo - starting over with a full download.")
+            reset_store(conn)
+
+    ## Stores from before deleted accounts were dropped on merge get them cleared out the same way
+    with conn:
+        drop_accounts(conn, [account_id for (account_id,) in conn.execute("SELECT id FROM accounts WHERE json_extract(data, '$.deleted')")])
+
+    ## Indexes for the sync (account and date) and for the drill-down's filters (date, category)
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS transactions_account_date ON transactions (account_id, date);
+        CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date);
+        CREATE INDEX IF NOT EXISTS transactions_category_date ON transactions (category_name, date);
+    """)
+    return conn
+
+## Function to open a store read-only, for the Dash app - WAL mode lets it read while the backend is writing
+def open_store_readonly(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+## Function to wipe everything so the next sync is a full download
+def reset_store(conn):
+    with conn:
+        conn.execute("DELETE FROM sync_state")
+        conn.execute("DELETE FROM accounts")
+        conn.execute("DELETE FROM transactions")
+        conn.execute("DELETE FROM dirty_years")
+        conn.execute("DELETE FROM year_checkpoints")
+        conn.execute("DELETE FROM month_checkpoints")
+        conn.execute("DELETE FROM rollup_years")
+        conn.execute("DELETE FROM category_months")
+        conn.execute("DELETE FROM payee_months")
+        conn.execute("DELETE FROM largest_transactions")
+
+## Function to get the server_knowledge from the last sync of an endpoint (None if it has never been synced)
+def get_server_knowledge(conn, endpoint):
+    row = conn.execute("SELECT server_knowledge FROM sync_state WHERE endpoint = ?", (endpoint,)).fetchone()
+    return row[0] if row else None
+
+## Function to merge a batch of accounts returned by the API - new and updated accounts are kept whole, deleted ones are
+## dropped, so the store holds what the accounts endpoint would return on a full download (which leaves deleted accounts
+## out). Anything still filed under a deleted account goes with it, and its years are marked for a recompute.
+def merge_accounts(conn, endpoint, accounts, server_knowledge):
+    with conn:
+        drop_accounts(conn, [acc['id'] for acc in accounts if acc.get('deleted')])
+        conn.executemany(
+            "INSERT OR REPLACE INTO accounts (id, name, data) VALUES (?, ?, ?)",
+            [(acc['id'], acc['name'], json.dumps(acc)) for acc in accounts if not acc.get('deleted')]
+        )
+        conn.execute("INSERT OR REPLACE INTO sync_state (endpoint, server_knowledge) VALUES (?, ?)", (endpoint, server_knowledge))
+
+## Function to drop accounts and everything filed under them, marking the years they had transactions in as dirty
+## (run inside the caller's transaction)
+def drop_accounts(conn, account_ids):
+    account_ids = [(account_id,) for account_id in account_ids]
+    conn.executemany(
+        "INSERT OR IGNORE INTO dirty_years (account_id, year) SELECT DISTINCT account_id, CAST(substr(date, 1, 4) AS INTEGER) FROM transactions WHERE account_id = ?",
+        account_ids
+    )
+    conn.executemany("DELETE FROM transactions WHERE account_id = ?", account_ids)
+    conn.executemany("DELETE FROM accounts WHERE id = ?", account_ids)
+
+## Function to merge a batch of transactions returned by the API (a ynab_ingest.TransactionColumns) - new and updated
+## transactions are upserted, deleted ones are dropped. The knowledge is saved in the same commit so a crash can never
+## leave the two out of step.
+def merge_transactions(conn, endpoint, columns, server_knowledge):
+    with conn:
+        ## Mark the years each transaction used to sit in, and the years they sit in now, as needing a recompute
+        conn.executemany(
+            "INSERT OR IGNORE INTO dirty_years (account_id, year) SELECT account_id, CAST(substr(date, 1, 4) AS INTEGER) FROM transactions WHERE id = ?",
+            ((tx_id,) for tx_id, *_ in columns.rows())
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO dirty_years (account_id, year) VALUES (?, ?)",
+            ((account_id, int(tx_date[:4])) for _, account_id, tx_date, _, deleted, *_ in columns.rows() if not deleted)
+        )
+        conn.executemany(
+            "DELETE FROM transactions WHERE id = ?",
+            ((tx_id,) for tx_id, _, _, _, deleted, *_ in columns.rows() if deleted)
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO transactions (id, account_id, date, amount, payee_name, category_name, memo) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((tx_id, account_id, tx_date, amount, payee_name, category_name, memo) for tx_id, account_id, tx_date, amount, deleted, payee_name, category_name, memo in columns.rows() if not deleted)
+        )
+        conn.execute("INSERT OR REPLACE INTO sync_state (endpoint, server_knowledge) VALUES (?, ?)", (endpoint, server_knowledge))
+
+## Function to get every stored account
+def get_accounts(conn):
+    return [json.loads(data) for (data,) in conn.execute("SELECT data FROM accounts ORDER BY name")]
+
+## Function to get the years that have transactions
+def get_transaction_years(conn):
+    return {int(year) for (year,) in conn.execute("SELECT DISTINCT substr(date, 1, 4) FROM transactions")}
+
+## Function to get one year's transactions as four parallel columns (ids, account_ids, dates, amounts), ordered by date and id
+def get_year_transaction_columns(conn, year):
+    rows = conn.execute(
+        "SELECT id, account_id, date, amount FROM transactions WHERE date BETWEEN ? AND ? ORDER BY date, id", (f"{year}-01-01", f"{year}-12-31")
+    ).fetchall()
+    if not rows:
+        return [], [], [], []
+    return tuple(list(column) for column in zip(*rows))
+
+## Function to get the (account_id, year) pairs touched by a merge since the dirty marks were last cleared
+def get_dirty_years(conn):
+    return set(conn.execute("SELECT account_id, year FROM dirty_years"))
+
+## Function to clear the dirty marks once everything downstream of them has been written
+def clear_dirty_years(conn):
+    with conn:
+        conn.execute("DELETE FROM dirty_years")
+
+## Function to get the stored content hash for every checkpointed (account_id, year)
+def get_year_checkpoint_hashes(conn):
+    return {(account_id, year): content_hash for account_id, year, content_hash in conn.execute("SELECT account_id, year, content_hash FROM year_checkpoints")}
+
+## Function to get every transaction in a set of years, as a cursor over (account_id, date, amount, id) rows in no
+## particular order with ids as bytes. Matching on the year keeps SQLite to one pass over the table rather than an
+## index lookup per row.
+def get_year_transactions(conn, years):
+    years = sorted(years)
+    return conn.execute(
+        f"SELECT account_id, date, amount, CAST(id AS BLOB) FROM transactions WHERE CAST(substr(date, 1, 4) AS INTEGER) IN ({','.join('?' * len(years))})",
+        years
+    )
+
+## Function to save checkpoints - each (account_id, year, content_hash, month_net_flow, month_counts), with twelve monthly
+## net flows and transaction counts - all in one transaction
+def save_year_checkpoints(conn, checkpoints):
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO year_checkpoints (account_id, year, content_hash) VALUES (?, ?, ?)",
+            [(account_id, year, year_hash) for account_id, year, year_hash, _, _ in checkpoints]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO month_checkpoints (account_id, year, month, net_flow, number_of_transactions) VALUES (?, ?, ?, ?, ?)",
+            [
+                (account_id, year, month + 1, int(net_flow), int(count))
+                for account_id, year, _, month_net_flow, month_counts in checkpoints
+                for month, (net_flow, count) in enumerate(zip(month_net_flow, month_counts))
+            ]
+        )
+
+## Function to get the monthly checkpoints for a set of accounts as rows of (account_id, year, month, net_flow, number_of_transactions)
+def get_month_checkpoints(conn, account_ids, years_range):
+    account_ids = list(account_ids)
+    placeholders = ','.join('?' * len(account_ids))
+    return conn.execute(
+        f"SELECT account_id, year, month, net_flow, number_of_transactions FROM month_checkpoints WHERE account_id IN ({placeholders}) AND year BETWEEN ? AND ?",
+        account_ids + [years_range[0], years_range[-1]]
+    ).fetchall()
+
+## Columns the drill-down can show, filter and sort on, and the SQL behind each (amounts are filtered in dollars)
+DETAIL_COLUMNS = {
+    'date': 't.date',
+    'account_name': 'a.name',
+    'payee_name': 't.payee_name',
+    'category_name': 't.category_name',
+    'memo': 't.memo',
+    'amount': 't.amount / 1000.0',
+}
+DETAIL_OPERATORS = {'=', '!=', '<', '<=', '>', '>=', 'contains', 'datestartswith'}
+
+## Function to get one page of transactions for a set of accounts between two dates, filtered and sorted in SQL. Filters
+## are (column, operator, value) and sort_by is (column, 'asc' or 'desc'), both using the names in DETAIL_COLUMNS.
+## Returns the page as (date, account_name, payee_name, category_name, memo, amount) rows, plus the total number of matches.
+def query_transactions(conn, account_ids, start_date, end_date, filters=(), sort_by=(), limit=25, offset=0):
+    account_ids = list(account_ids)
+    where = [f"t.account_id IN ({','.join('?' * len(account_ids))})", "t.date BETWEEN ? AND ?"]
+    params = account_ids + [start_date, end_date]
+    for column, operator, value in filters:
+        if column not in DETAIL_COLUMNS or operator not in DETAIL_OPERATORS:
+            raise ValueError(f"Can't filter on {column} {operator}.")
+        if operator == 'contains':
+            where.append(f"{DETAIL_COLUMNS[column]} LIKE ?")
+            params.append(f"%{value}%")
+        elif operator == 'datestartswith':
+            where.append(f"{DETAIL_COLUMNS[column]} LIKE ?")
+            params.append(f"{value}%")
+        else:
+            where.append(f"{DETAIL_COLUMNS[column]} {operator} ?")
+            params.append(value)
+    order = [f"{DETAIL_COLUMNS[column]} {'DESC' if direction == 'desc' else 'ASC'}" for column, direction in sort_by if column in DETAIL_COLUMNS]
+    from_where = f"FROM transactions t JOIN accounts a ON a.id = t.account_id WHERE {' AND '.join(where)}"
+    total = conn.execute(f"SELECT COUNT(*) {from_where}", params).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT t.date, a.name, t.payee_name, t.category_name, t.memo, t.amount {from_where} ORDER BY {', '.join(order + ['t.date DESC', 't.id'])} LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    ).fetchall()
+    return rows, total
+
+## Spend is money going out with a category - transfers and off-budget moves have none, so they're left out
+SPEND_FILTER = "amount < 0 AND category_name IS NOT NULL"
+LARGEST_TRANSACTIONS = 10
+
+## Function to get the years the Wrapped rollups have been built for
+def get_rollup_years(conn):
+    return {year for (year,) in conn.execute("SELECT year FROM rollup_years")}
+
+## Function to rebuild the Wrapped rollups for the given years from the transactions table, leaving every other year alone
+def refresh_rollups(conn, years):
+    with conn:
+        for year in sorted(years):
+            year_range = (f"{year}-01-01", f"{year}-12-31")
+            for table, column in [('category_months', 'category_name'), ('payee_months', 'payee_name')]:
+                conn.execute(f"DELETE FROM {table} WHERE year = ?", (year,))
+                conn.execute(
+                    f"""INSERT INTO {table} (year, month, {column}, spend, number_of_transactions)
+                        SELECT ?, CAST(substr(date, 6, 2) AS INTEGER), COALESCE({column}, '(none)'), -SUM(amount), COUNT(*)
+                        FROM transactions WHERE date BETWEEN ? AND ? AND {SPEND_FILTER} GROUP BY 2, 3""",
+                    (year, *year_range)
+                )
+            conn.execute("DELETE FROM largest_transactions WHERE year = ?", (year,))
+            conn.execute(
+                f"""INSERT INTO largest_transactions (year, rank, id, account_id, date, payee_name, category_name, amount)
+                    SELECT ?, ROW_NUMBER() OVER (ORDER BY amount, id), id, account_id, date, payee_name, category_name, amount
+                    FROM transactions WHERE date BETWEEN ? AND ? AND {SPEND_FILTER} ORDER BY amount, id LIMIT ?""",
+                (year, *year_range, LARGEST_TRANSACTIONS)
+            )
+            conn.execute("INSERT OR REPLACE INTO rollup_years (year) VALUES (?)", (year,))
+
+## Function to get a year's biggest categories or payees (by='category' or 'payee') as (name, spend, number_of_transactions) rows
+def get_top_spend(conn, by, year, limit=10):
+    table, column = {'category': ('category_months', 'category_name'), 'payee': ('payee_months', 'payee_name')}[by]
+    return conn.execute(
+        f"SELECT {column}, SUM(spend), SUM(number_of_transactions) FROM {table} WHERE year = ? GROUP BY {column} ORDER BY SUM(spend) DESC LIMIT ?",
+        (year, limit)
+    ).fetchall()
+
+## Function to get a year's spend month by month, as twelve totals
+def get_monthly_spend(conn, year):
+    month_spend = [0] * 12
+    for month, spend in conn.execute("SELECT month, SUM(spend) FROM category_months WHERE year = ? GROUP BY month", (year,)):
+        month_spend[month - 1] = spend
+    return month_spend
+
+## Function to get the categories whose spend moved most since the year before, as (category_name, spend, previous_spend) rows
+def get_category_deltas(conn, year, limit=10):
+    return conn.execute(
+        """SELECT category_name, SUM(CASE WHEN year = ? THEN spend ELSE 0 END) AS year_spend, SUM(CASE WHEN year = ? THEN spend ELSE 0 END) AS prior_spend
+           FROM category_months WHERE year IN (?, ?) GROUP BY category_name ORDER BY ABS(year_spend - prior_spend) DESC LIMIT ?""",
+        (year, year - 1, year, year - 1, limit)
+    ).fetchall()
+
+## Function to get a year's largest transactions as (date, account_name, payee_name, category_name, amount) rows
+def get_largest_transactions(conn, year):
+    return conn.execute(
+        """SELECT l.date, a.name, l.payee_name, l.category_name, l.amount
+           FROM largest_transactions l JOIN accounts a ON a.id = l.account_id WHERE l.year = ? ORDER BY l.rank""",
+        (year,)
+    ).fetchall()
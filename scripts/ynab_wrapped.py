@@ -6,22 +6,136 @@
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash import dash_table
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_daq as daq
-import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
-import plotly.express as px
+from plotly.io.json import to_json_plotly
 import pandas as pd
+import numpy as np
+import account_groupings
+import ynab_aggregations
+import ynab_cache
+import ynab_calculations
+import ynab_data
+import ynab_store
+import importlib.util
+import os
+import re
 
-## Load the processed data
-df_account_balances = pd.read_csv('/Users/kevinroche22/PythonData/ynab_wrapped/intermediate outputs/account_balances.csv')
+## Where the backend wrote its outputs - one folder per budget (override YNAB_WRAPPED_DIR to point somewhere else)
+OUTPUT_DIR = f"{os.getenv('YNAB_WRAPPED_DIR', '/Users/kevinroche22/PythonData/ynab_wrapped')}/intermediate outputs"
+BUDGETS_DIR = f'{OUTPUT_DIR}/budgets'
+STORE_DIR = f'{OUTPUT_DIR}/transaction_store'
 
-## Get unique account types and account names for dropdowns
-account_types = df_account_balances['account_type'].unique()
-account_names = df_account_balances['account_name'].unique()
+## Dark mode theme - the stylesheet dash_bootstrap_components.themes.SLATE points at, without importing the whole
+## component library for one URL
+SLATE_THEME = 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.6/dist/slate/bootstrap.min.css'
 
-## Create Dash app with dark mode theme
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SLATE])
+## Callback results cached on disk, shared by every worker process when served by ynab_wrapped_server.py
+CALLBACK_CACHE_DIR = os.getenv('CALLBACK_CACHE_DIR', f'{OUTPUT_DIR}/callback_cache')
+CALLBACK_CACHE_MAX_MB = float(os.getenv('CALLBACK_CACHE_MAX_MB', '256'))
+
+## Transaction drill-down - rows per page, and the parts of a DataTable filter query (e.g. '{payee_name} contains "Coffee"')
+DRILLDOWN_PAGE_SIZE = 25
+FILTER_PART = re.compile(r'^\{(?P<column>[^}]+)\}\s+(?P<operator>[is]?(?:eq|ne|lt|le|gt|ge|contains|datestartswith|!=|<=|>=|=|<|>))\s+(?P<value>.+)$')
+FILTER_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+## Function to get the date picker bounds for a budget - the whole cube, starting on the current year
+def date_range_bounds(budget):
+    cube_months = budget['cube_months']
+    max_date = (cube_months.iloc[-1] + pd.offsets.MonthEnd(0)).date()
+    return cube_months.iloc[0].date(), max_date, cube_months[cube_months.dt.year == cube_months.dt.year.max()].iloc[0].date(), max_date
+
+## Function to turn a DataTable filter query into (column, operator, value) filters for ynab_store.query_transactions
+def parse_filter_query(filter_query):
+    filters = []
+    for part in (filter_query or '').split(' && '):
+        match = FILTER_PART.match(part.strip())
+        if not match:
+            continue
+        operator = match['operator']
+        if operator[0] in 'is' and operator[1:] in (*FILTER_OPERATORS, *FILTER_OPERATORS.values(), 'contains', 'datestartswith'):
+            operator = operator[1:]  ## Case-(in)sensitive variants - SQLite's LIKE is case-insensitive either way
+        operator = FILTER_OPERATORS.get(operator, operator)
+        value = match['value'].strip()
+        if value[0] == value[-1] and value[0] in ('"', "'", '`') and len(value) > 1:
+            value = value[1:-1].replace('\\' + value[0], value[0])
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        filters.append((match['column'], operator, value))
+    return filters
+
+## Function to open a budget's transaction store read-only (None if the backend hasn't made one yet)
+def open_budget_store(budget_id):
+    store_path = f'{STORE_DIR}/{budget_id}.sqlite'
+    return ynab_store.open_store_readonly(store_path) if os.path.exists(store_path) else None
+
+## Function to build a Year in Review chart - dollar amounts on the value axis, hovertext the "Hide Numbers" toggle can mask
+def spend_figure(title, traces, horizontal=False):
+    money_axis = {'tickprefix': '$', 'tickformat': ',.0f', 'tickfont': dict(color='white')}
+    label_axis = {'tickfont': dict(color='white'), 'automargin': True}
+    return {
+        'data': traces,
+        'layout': go.Layout(
+            title=title,
+            plot_bgcolor='#272b30',
+            paper_bgcolor='#272b30',
+            font=dict(color='white'),
+            xaxis=money_axis if horizontal else label_axis,
+            yaxis=label_axis if horizontal else money_axis,
+            barmode='group',
+            legend=dict(orientation='h')
+        )
+    }
+
+## Function to get a budget's data from the current snapshot (take it once per callback, so the whole callback sees one snapshot).
+## If the budget isn't there - no budget is selected because every budget's outputs are gone - the callback leaves the
+## page as it is rather than failing on every refresh.
+def get_budget(budget_id):
+    budget = data_provider.snapshot.budgets.get(budget_id)
+    if budget is None:
+        raise dash.exceptions.PreventUpdate
+    return budget
+
+## Load every budget the backend has written outputs for, starting on BUDGET_ID if it's one of them. Watching for new
+## outputs starts when the app is run (or, under ynab_wrapped_server.py, in each worker once it's forked).
+data_provider = ynab_data.DataProvider(BUDGETS_DIR)
+snapshot = data_provider.snapshot
+budget_names = snapshot.budget_names
+if not snapshot.budgets:
+    raise RuntimeError(f"No budget outputs found in {BUDGETS_DIR} - run ynab_wrapped_backend.py (or ynab_wrapped_batch.py) first.")
+default_budget_id = os.getenv('BUDGET_ID') if os.getenv('BUDGET_ID') in snapshot.budgets else next(iter(snapshot.budgets))
+
+## Get unique account types and account names for the default budget's dropdowns
+account_types = snapshot.budgets[default_budget_id]['account_types']
+account_names = snapshot.budgets[default_budget_id]['account_balances'].account_names
+min_date, max_date, start_date, end_date = date_range_bounds(snapshot.budgets[default_budget_id])
+
+## Per-year totals for each selection, shared by the chart and callout callbacks
+aggregation_cache = ynab_aggregations.AggregationCache()
+
+## Finished callback results, keyed by the snapshot they came from so a reload never serves stale ones. Only callbacks
+## whose result depends on nothing but their inputs and the snapshot are cached this way.
+callback_cache = ynab_cache.DiskCache(CALLBACK_CACHE_DIR, int(CALLBACK_CACHE_MAX_MB * 1024 ** 2))
+cached_callback = callback_cache.memoize(lambda: data_provider.snapshot.version)
+
+## Dash app whose layout is serialized once, on the first page load, rather than on every one - it's built once at
+## startup and never changes (new data reaches open pages through the callbacks)
+class WrappedDash(dash.Dash):
+
+    layout_json = None
+
+    def serve_layout(self):
+        if self.layout_json is None:
+            self.layout_json = to_json_plotly(self.get_layout())
+        return self.backend.make_response(self.layout_json, mimetype='application/json')
+
+## Create Dash app with dark mode theme, gzipping callback responses when flask-compress is installed
+app = WrappedDash(__name__, external_stylesheets=[SLATE_THEME], compress=importlib.util.find_spec('flask_compress') is not None)
 
 
 ############
@@ -38,9 +152,28 @@ app.layout = html.Div([
             style={'font-size': '32px', 'font-weight': 'bold', 'padding': '20px', 'textAlign': 'center', 'color': '#fff'}
         ),
 
-        ## Box to contain the toggle and two dropdowns in a row
+        ## Box to contain the budget picker, the toggle and two dropdowns in a row
         html.Div([ 
 
+            ## Budget Section
+            html.Div([ 
+                html.Div('Budget', style={'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}),  
+                dcc.Dropdown(
+                    id='budget-dropdown',
+                    options=[{'label': budget_name, 'value': budget_id} for budget_id, budget_name in budget_names.items()],
+                    value=default_budget_id,
+                    clearable=False,
+                    style={
+                        'width': '100%',
+                        'margin': '0px',
+                        'backgroundColor': '#444', 
+                        'color': '#444',
+                        'border-radius': '5px', 
+                        'border': '1px solid #666' 
+                    }
+                ),
+            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '23%', 'padding': '10px'}),
+
             ## Hide Numbers Section
             html.Div([ 
                 html.Div('Hide Numbers', style={'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}),  
@@ -49,9 +182,9 @@ app.layout = html.Div([
                     label='',
                     color='#7CDD7E',
                     value=True,  ## Initially hide the numbers
-                    style={'width': '100%', 'margin': '0px', 'padding': '0px 110px'}
+                    style={'width': '100%', 'margin': '0px', 'padding': '0px 70px'}
                 ),
-            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '30%', 'padding': '10px'}),
+            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '23%', 'padding': '10px'}),
 
             ## Account Type Section
             html.Div([ 
@@ -70,7 +203,7 @@ app.layout = html.Div([
                         'border': '1px solid #666' 
                     }
                 ),
-            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '30%', 'padding': '10px'}),
+            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '23%', 'padding': '10px'}),
 
             ## Account Name Section
             html.Div([ 
@@ -89,7 +222,7 @@ app.layout = html.Div([
                         'border': '1px solid #666' 
                     }
                 ),
-            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '30%', 'padding': '10px'}),
+            ], style={'display': 'flex', 'flex-direction': 'column', 'align-items': 'center', 'width': '23%', 'padding': '10px'}),
 
         ], style={ 
             'display': 'flex', 
@@ -128,6 +261,70 @@ app.layout = html.Div([
 
     ], style={'display': 'flex', 'width': '80%', 'margin': '0 auto', 'justify-content': 'space-between'}),
 
+    ## Year in Review - where the money went, from the spend rollups the backend keeps in the transaction store
+    html.Div([
+
+        ## Title and year picker
+        html.Div([
+            html.Div('Year in Review', style={'font-size': '24px', 'font-weight': 'bold', 'color': '#fff', 'margin-right': '15px'}),
+            dcc.Dropdown(
+                id='wrapped-year-dropdown',
+                clearable=False,
+                style={
+                    'width': '150px',
+                    'backgroundColor': '#444',
+                    'color': '#444',
+                    'border-radius': '5px',
+                    'border': '1px solid #666'
+                }
+            ),
+        ], style={'display': 'flex', 'justify-content': 'center', 'align-items': 'center', 'padding': '10px'}),
+
+        ## Top Categories and Top Payees
+        html.Div([
+            html.Div([
+                dcc.Graph(id='top-categories', style={'width': '75vh', 'height': '55vh'}),
+            ], style={'width': '50%', 'padding': '0 20px'}),
+            html.Div([
+                dcc.Graph(id='top-payees', style={'width': '75vh', 'height': '55vh'}),
+            ], style={'width': '50%', 'padding': '0 20px'}),
+        ], style={'display': 'flex', 'justify-content': 'space-between'}),
+
+        ## Monthly Spend and Category Changes
+        html.Div([
+            html.Div([
+                dcc.Graph(id='monthly-spend', style={'width': '75vh', 'height': '55vh'}),
+            ], style={'width': '50%', 'padding': '0 20px'}),
+            html.Div([
+                dcc.Graph(id='category-deltas', style={'width': '75vh', 'height': '55vh'}),
+            ], style={'width': '50%', 'padding': '0 20px'}),
+        ], style={'display': 'flex', 'justify-content': 'space-between'}),
+
+        ## Largest Transactions
+        html.Div([
+            html.Div('Largest Transactions', style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '10px', 'color': '#fff'}),
+            dash_table.DataTable(
+                id='largest-transactions',
+                columns=[
+                    {'name': 'Date', 'id': 'date'},
+                    {'name': 'Account', 'id': 'account_name'},
+                    {'name': 'Payee', 'id': 'payee_name'},
+                    {'name': 'Category', 'id': 'category_name'},
+                    {'name': 'Amount', 'id': 'amount'},
+                ],
+                style_header={'backgroundColor': '#333', 'color': '#fff', 'font-weight': 'bold', 'border': '1px solid #666'},
+                style_cell={'backgroundColor': '#444', 'color': '#fff', 'border': '1px solid #666', 'textAlign': 'left'},
+            ),
+        ], style={ 
+            'padding': '10px', 
+            'background-color': '#444', 
+            'border': '2px solid #666',  
+            'border-radius': '15px', 
+            'margin': '0 10px 15px',
+        }),
+
+    ], style={'width': '80%', 'margin': '0 auto'}),
+
     ## Callout boxes
     html.Div([
 
@@ -188,26 +385,231 @@ app.layout = html.Div([
         'width': '80%', 
         'margin': '0 auto',
     }),
+
+    ## Date range callout boxes - answered from the month cube, so any range comes back straight away
+    html.Div([
+
+        ## Date Range
+        html.Div([ 
+            html.Div(
+                'Date Range', 
+                style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}
+            ),
+            dcc.DatePickerRange(
+                id='date-range',
+                min_date_allowed=min_date,
+                max_date_allowed=max_date,
+                start_date=start_date,  ## Default to the current year
+                end_date=end_date,
+                display_format='MMM YYYY',
+            ),
+        ], style={ 
+            'width': '25%', 
+            'padding': '10px', 
+            'background-color': '#444', 
+            'border': '2px solid #666',  
+            'border-radius': '15px', 
+            'margin': '0 10px', 
+            'textAlign': 'center'
+        }),
+
+        ## Balance at End of Range
+        html.Div([ 
+            html.Div(
+                'Balance at End of Range', 
+                style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}
+            ),
+            html.Div(id='range-end-balance', style={'font-size': '20px', 'textAlign': 'center', 'color': '#fff'}),
+        ], style={ 
+            'width': '25%', 
+            'padding': '10px', 
+            'background-color': '#444', 
+            'border': '2px solid #666',  
+            'border-radius': '15px', 
+            'margin': '0 10px', 
+            'textAlign': 'center'
+        }),
+
+        ## Change in Balance Over Range
+        html.Div([ 
+            html.Div(
+                'Change in Balance Over Range', 
+                style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}
+            ),
+            html.Div(id='range-change-in-balance', style={'font-size': '20px', 'textAlign': 'center', 'color': '#fff'}),
+        ], style={ 
+            'width': '25%', 
+            'padding': '10px', 
+            'background-color': '#444', 
+            'border': '2px solid #666',  
+            'border-radius': '15px', 
+            'margin': '0 10px', 
+            'textAlign': 'center'
+        }),
+
+        ## Transactions Over Range
+        html.Div([ 
+            html.Div(
+                'Transactions Over Range', 
+                style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '5px', 'color': '#fff'}
+            ),
+            html.Div(id='range-transactions', style={'font-size': '20px', 'textAlign': 'center', 'color': '#fff'}),
+        ], style={ 
+            'width': '25%', 
+            'padding': '10px', 
+            'background-color': '#444', 
+            'border': '2px solid #666',  
+            'border-radius': '15px', 
+            'margin': '0 10px', 
+            'textAlign': 'center'
+        }),
+
+    ], style={ 
+        'display': 'flex', 
+        'justify-content': 'space-between',
+        'width': '80%', 
+        'margin': '15px auto',
+    }),
+
+    ## Transaction drill-down - click a year on either chart to page through its transactions
+    html.Div([
+        html.Div(id='drilldown-title', style={'font-size': '16px', 'font-weight': 'bold', 'textAlign': 'center', 'margin-bottom': '10px', 'color': '#fff'}),
+        dash_table.DataTable(
+            id='drilldown-table',
+            columns=[
+                {'name': 'Date', 'id': 'date'},
+                {'name': 'Account', 'id': 'account_name'},
+                {'name': 'Payee', 'id': 'payee_name'},
+                {'name': 'Category', 'id': 'category_name'},
+                {'name': 'Memo', 'id': 'memo'},
+                {'name': 'Amount', 'id': 'amount', 'type': 'numeric'},
+            ],
+            page_action='custom',  ## Paging, sorting and filtering all happen in the transaction store
+            page_current=0,
+            page_size=DRILLDOWN_PAGE_SIZE,
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
+            style_header={'backgroundColor': '#333', 'color': '#fff', 'font-weight': 'bold', 'border': '1px solid #666'},
+            style_filter={'backgroundColor': '#555', 'color': '#fff', 'border': '1px solid #666'},
+            style_cell={'backgroundColor': '#444', 'color': '#fff', 'border': '1px solid #666', 'textAlign': 'left'},
+        ),
+    ], style={ 
+        'width': '80%', 
+        'padding': '10px', 
+        'background-color': '#444', 
+        'border': '2px solid #666',  
+        'border-radius': '15px', 
+        'margin': '0 auto 15px',
+        'box-sizing': 'border-box'
+    }),
+
+    ## Unmasked figures and callout text from the server - the Hide Numbers toggle masks them in the browser
+    dcc.Store(id='chart-figures'),
+    dcc.Store(id='callout-values'),
+    dcc.Store(id='range-callout-values'),
+    dcc.Store(id='drilldown-year'),
+    dcc.Store(id='drilldown-rows'),
+    dcc.Store(id='wrapped-insights'),
+
+    ## Which data snapshot the page is showing - checked against the provider every DATA_RELOAD_INTERVAL seconds
+    dcc.Store(id='data-version', data=snapshot.version),
+    dcc.Interval(id='data-reload', interval=ynab_data.DATA_RELOAD_INTERVAL * 1000),
 ])
 
 
+#################
+## Data Reload ##
+#################
+
+@app.callback(
+    Output('data-version', 'data'),
+    [Input('data-reload', 'n_intervals')],
+    [State('data-version', 'data')]
+)
+
+def check_for_new_data(n_intervals, data_version):
+
+    ## Only pass a new version on when the provider has swapped in a new snapshot, so nothing downstream re-runs otherwise
+    if data_provider.snapshot.version == data_version:
+        return dash.no_update
+    return data_provider.snapshot.version
+
+@app.callback(
+    [
+        Output('budget-dropdown', 'options'),
+        Output('budget-dropdown', 'value')
+    ],
+    [Input('data-version', 'data')],
+    [State('budget-dropdown', 'value')]
+)
+
+def update_budget_dropdown(data_version, budget_id):
+
+    ## Pick up any new budgets, staying on the current one unless it's gone (and on none if every budget's outputs are)
+    snapshot = data_provider.snapshot
+    budget_options = [{'label': budget_name, 'value': budget_id} for budget_id, budget_name in snapshot.budget_names.items()]
+    return (budget_options, budget_id if budget_id in snapshot.budgets else next(iter(snapshot.budgets), None))
+
+
 ###############
 ## Dropdowns ##
 ###############
 
+@app.callback(
+    [
+        Output('account-type-dropdown', 'options'),
+        Output('account-type-dropdown', 'value'),
+        Output('date-range', 'min_date_allowed'),
+        Output('date-range', 'max_date_allowed'),
+        Output('date-range', 'start_date'),
+        Output('date-range', 'end_date')
+    ],
+    [
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')
+    ],
+    [
+        State('account-type-dropdown', 'value'),
+        State('date-range', 'start_date'),
+        State('date-range', 'end_date')
+    ]
+)
+
+def update_budget(budget_id, data_version, account_types, start_date, end_date):
+    budget = get_budget(budget_id)
+    account_type_options = [{'label': account_type, 'value': account_type} for account_type in budget['account_types']]
+    min_date, max_date, default_start_date, default_end_date = date_range_bounds(budget)
+
+    ## Switching budget starts again from its first account type and the current year
+    if 'budget-dropdown' in [trigger['prop_id'].split('.')[0] for trigger in dash.callback_context.triggered]:
+        return (account_type_options, budget['account_types'][0], min_date, max_date, default_start_date, default_end_date)
+
+    ## New data for the same budget keeps whatever is still selected
+    if isinstance(account_types, str):
+        account_types = [account_types]
+    account_types = [account_type for account_type in account_types or [] if account_type in budget['account_types']] or budget['account_types'][0]
+    return (account_type_options, account_types, min_date, max_date, start_date or default_start_date, end_date or default_end_date)
+
 @app.callback(
     Output('account-name-dropdown', 'options'),
-    [Input('account-type-dropdown', 'value')]
+    [
+        Input('account-type-dropdown', 'value'),
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')
+    ]
 )
 
-def update_account_name_dropdown(account_types):
+def update_account_name_dropdown(account_types, budget_id, data_version):
 
     ## Ensure account_types is always a list, even if a single account type is selected
     if isinstance(account_types, str):
         account_types = [account_types]
     
     ## When account types are selected, get the list of unique account names for those types
-    filtered_accounts = df_account_balances[df_account_balances['account_type'].isin(account_types)]['account_name'].unique()
+    filtered_accounts = get_budget(budget_id)['account_balances'].names_for_types(account_types)
     return [{'label': account_name, 'value': account_name} for account_name in filtered_accounts]
 
 
@@ -216,57 +618,35 @@ def update_account_name_dropdown(account_types):
 ############
 
 @app.callback(
-    [
-        Output('balance-over-time', 'figure'),
-        Output('changes-over-time', 'figure')
-    ],
+    Output('chart-figures', 'data'),
     [
         Input('account-type-dropdown', 'value'),
         Input('account-name-dropdown', 'value'),
-        Input('toggle-dots', 'value')
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')  ## Re-run when a new snapshot arrives
     ]
 )
-
-def update_charts(account_types, account_names, hide_numbers):
-    
-    ## Ensure account_types is always a list
-    if isinstance(account_types, str):
-        account_types = [account_types]
+@cached_callback
+def update_charts(account_types, account_names, budget_id, data_version):
     
-    ## Default to all accounts if no account names are selected
-    if not account_names:
-        account_names = df_account_balances[df_account_balances['account_type'].isin(account_types)]['account_name'].unique()
-
-    ## Filter data based on selected account types and names
-    filtered_data = df_account_balances[df_account_balances['account_type'].isin(account_types) & df_account_balances['account_name'].isin(account_names)]
+    ## Per-year totals for the selected account types and names (all accounts of those types if no names are selected)
+    budget = get_budget(budget_id)
+    year_totals = aggregation_cache.year_totals(budget_id, budget['version'], budget['account_balances'], account_types, account_names)
     
     ## Prepare data for the balance-over-time chart
-    balance_over_time_data = filtered_data.groupby(['year'])['end_of_year_balance'].sum().reset_index()
-    changes_over_time_data = filtered_data.groupby(['year'])['change_in_balance'].sum().reset_index()
-    changes_over_time_data = changes_over_time_data[changes_over_time_data['year'] != 2022]
-
-    ## Apply formatting only when 'Hide Numbers' is toggled
-    if hide_numbers:
-
-        ## Keep numeric values but hide them in the hovertext and Y-Axis formatting
-        balance_over_time_data['formatted_balance'] = '$•••'
-        changes_over_time_data['formatted_change'] = '$•••'
-        
-        ## Y-Axis tick labels should show "$•••" but still scale correctly
-        yaxis_tickvals = balance_over_time_data['year']
-        yaxis_ticktext_balance = ['$•••'] * len(yaxis_tickvals)
-        yaxis_ticktext_changes = ['$•••'] * len(yaxis_tickvals)
+    balance_over_time_data = year_totals[['year', 'end_of_year_balance']].copy()
+    changes_over_time_data = year_totals[['year', 'change_in_balance']].copy()
+    ## The budget's first year (FIRST_YEAR in the backend) has no year before it, so its change in balance is left out
+    first_year = budget['account_balances'].years.min() if len(budget['account_balances'].years) else None
+    changes_over_time_data = changes_over_time_data[changes_over_time_data['year'] != first_year]
 
-    else:
-
-        ## Apply currency formatting for hovertext
-        balance_over_time_data['formatted_balance'] = balance_over_time_data['end_of_year_balance'].apply(lambda x: f"${x:,.2f}")
-        changes_over_time_data['formatted_change'] = changes_over_time_data['change_in_balance'].apply(lambda x: f"${x:,.2f}")
-        
-        ## For Y-Axis, apply numeric currency formatting
-        yaxis_tickvals = balance_over_time_data['year']
-        yaxis_ticktext_balance = [f"${x:,.0f}" for x in balance_over_time_data['end_of_year_balance']]
-        yaxis_ticktext_changes = [f"${x:,.0f}" for x in changes_over_time_data['change_in_balance']]
+    ## Apply currency formatting for hovertext - 'Hide Numbers' swaps these for "$•••" in the browser (see assets/ynab_wrapped.js)
+    balance_over_time_data['formatted_balance'] = balance_over_time_data['end_of_year_balance'].apply(lambda x: f"${x:,.2f}")
+    changes_over_time_data['formatted_change'] = changes_over_time_data['change_in_balance'].apply(lambda x: f"${x:,.2f}")
+    
+    ## For Y-Axis, apply numeric currency formatting
+    yaxis_ticktext_balance = [f"${x:,.0f}" for x in balance_over_time_data['end_of_year_balance']]
+    yaxis_ticktext_changes = [f"${x:,.0f}" for x in changes_over_time_data['change_in_balance']]
     
     ## Balance Over Time Chart
     balance_over_time_figure = {
@@ -336,49 +716,51 @@ def update_charts(account_types, account_names, hide_numbers):
         )
     }
     
-    return balance_over_time_figure, changes_over_time_figure
+    return {'balance': balance_over_time_figure, 'changes': changes_over_time_figure}
+
+## Show the figures, masking their hovertext and y-axis labels in the browser when 'Hide Numbers' is on - flipping the
+## toggle never goes back to the server
+app.clientside_callback(
+    ClientsideFunction(namespace='ynab_wrapped', function_name='render_charts'),
+    [
+        Output('balance-over-time', 'figure'),
+        Output('changes-over-time', 'figure')
+    ],
+    [
+        Input('chart-figures', 'data'),
+        Input('toggle-dots', 'value')
+    ]
+)
 
 
 ###################
 ## Callout Boxes ##
 ###################
 
+## Each callout is sent to the browser as a [shown, hidden] pair, and 'Hide Numbers' picks one of the two there
 @app.callback(
-    [
-        Output('annual-increase', 'children'),
-        Output('annual-percentage-increase', 'children'),
-        Output('avg-transaction-amount', 'children')
-    ],
+    Output('callout-values', 'data'),
     [
         Input('account-type-dropdown', 'value'),
         Input('account-name-dropdown', 'value'),
-        Input('toggle-dots', 'value') 
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')
     ]
 )
+@cached_callback
+def update_callout_boxes(account_types, account_names, budget_id, data_version):
 
-def update_callout_boxes(account_types, account_names, hide_numbers):
-
-    ## Ensure account_types is always a list
-    if isinstance(account_types, str):
-        account_types = [account_types]
-    
-    ## Default to all accounts if no account names are selected
-    if not account_names:
-        account_names = df_account_balances[df_account_balances['account_type'].isin(account_types)]['account_name'].unique()
-
-    ## Filter data for the selected account types and names
-    filtered_data = df_account_balances[df_account_balances['account_type'].isin(account_types) & df_account_balances['account_name'].isin(account_names)]
-    
-    ## Group by year to perform calculations
-    filtered_data = filtered_data.groupby(['year']).agg(
-        total_balance=('end_of_year_balance', 'sum'),
-        total_transactions=('number_of_transactions', 'sum'),
-        total_change_in_balance=('change_in_balance', 'sum')
-    ).reset_index()
+    ## Per-year totals for the selected account types and names, shared with the charts
+    budget = get_budget(budget_id)
+    filtered_data = aggregation_cache.year_totals(budget_id, budget['version'], budget['account_balances'], account_types, account_names).rename(columns={
+        'end_of_year_balance': 'total_balance',
+        'number_of_transactions': 'total_transactions',
+        'change_in_balance': 'total_change_in_balance'
+    })
 
     ## Ensure the dataframe has data for at least two years (current and previous)
     if len(filtered_data) < 2:
-        return ("N/A", "N/A", "N/A")  ## If there's insufficient data, return "N/A" for all callouts
+        return [("N/A", "N/A")] * 3  ## If there's insufficient data, return "N/A" for all callouts
 
     ## Current and Previous Year Balances
     current_year_balance = filtered_data[filtered_data['year'] == filtered_data['year'].max()]['total_balance'].values[0]
@@ -386,14 +768,14 @@ def update_callout_boxes(account_types, account_names, hide_numbers):
     
     ## Annual Increase in Balance
     annual_increase = current_year_balance - previous_year_balance
-    formatted_annual_increase = "${:,.2f}".format(annual_increase) if not hide_numbers else "$•••"
+    formatted_annual_increase = ("${:,.2f}".format(annual_increase), "$•••")
 
     ## Annual Percentage Increase
     if previous_year_balance != 0:
         annual_percentage_increase = ((current_year_balance - previous_year_balance) / previous_year_balance) * 100
     else:
         annual_percentage_increase = 0
-    formatted_annual_percentage_increase = "{:.2f}%".format(annual_percentage_increase) if not hide_numbers else "$•••"
+    formatted_annual_percentage_increase = ("{:.2f}%".format(annual_percentage_increase), "$•••")
 
     ## Average Transaction Amount (CY)
     current_year_transactions = filtered_data[filtered_data['year'] == filtered_data['year'].max()]['total_transactions'].values[0]
@@ -404,10 +786,309 @@ def update_callout_boxes(account_types, account_names, hide_numbers):
         avg_transaction_amount = current_year_change_in_balance / current_year_transactions
     else:
         avg_transaction_amount = 0
-    formatted_avg_transaction_amount = "${:,.2f}".format(avg_transaction_amount) if not hide_numbers else "$•••"
+    formatted_avg_transaction_amount = ("${:,.2f}".format(avg_transaction_amount), "$•••")
+
+    return [formatted_annual_increase, formatted_annual_percentage_increase, formatted_avg_transaction_amount]
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ynab_wrapped', function_name='render_callouts'),
+    [
+        Output('annual-increase', 'children'),
+        Output('annual-percentage-increase', 'children'),
+        Output('avg-transaction-amount', 'children')
+    ],
+    [
+        Input('callout-values', 'data'),
+        Input('toggle-dots', 'value')
+    ]
+)
+
+
+
+##############################
+## Date Range Callout Boxes ##
+##############################
+
+@app.callback(
+    Output('range-callout-values', 'data'),
+    [
+        Input('account-type-dropdown', 'value'),
+        Input('account-name-dropdown', 'value'),
+        Input('date-range', 'start_date'),
+        Input('date-range', 'end_date'),
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')
+    ]
+)
+@cached_callback
+def update_range_callout_boxes(account_types, account_names, start_date, end_date, budget_id, data_version):
+
+    ## Ensure account_types is always a list
+    if isinstance(account_types, str):
+        account_types = [account_types]
+    budget = get_budget(budget_id)
+    cube_months, cube_rows = budget['cube_months'], budget['cube_rows']
+    cube_balance_running, cube_transactions_running = budget['cube_balance_running'], budget['cube_transactions_running']
+
+    ## Need both ends of the range
+    if not start_date or not end_date:
+        return [("N/A", "N/A")] * 3
+
+    ## Rows of the cube for the selected account types and names (all accounts of those types if no names are selected)
+    selected = cube_rows['account_type'].isin(account_types)
+    if account_names:
+        selected &= cube_rows['account_name'].isin(account_names)
+    rows = np.flatnonzero(selected.to_numpy())
+
+    ## Snap the range to whole months within the cube
+    first_month = cube_months.iloc[0]
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    start_month = min(max((start.year - first_month.year) * 12 + start.month - 1, 0), len(cube_months) - 1)
+    end_month = min(max((end.year - first_month.year) * 12 + end.month - 1, 0), len(cube_months) - 1)
+    if end_month < start_month:
+        return [("N/A", "N/A")] * 3
+
+    ## Balance at the end of the range (running total since the budget started), and totals over the range
+    end_balance = cube_balance_running[rows, end_month].sum() / 1000
+    change_in_balance = ynab_calculations.running_range_total(cube_balance_running, rows, start_month, end_month) / 1000
+    number_of_transactions = int(ynab_calculations.running_range_total(cube_transactions_running, rows, start_month, end_month))
+
+    ## Format, alongside what to show when the numbers are hidden
+    formatted_end_balance = ("${:,.2f}".format(end_balance), "$•••")
+    formatted_change_in_balance = ("${:,.2f}".format(change_in_balance), "$•••")
+    formatted_number_of_transactions = ("{:,}".format(number_of_transactions), "•••")
+
+    return [formatted_end_balance, formatted_change_in_balance, formatted_number_of_transactions]
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ynab_wrapped', function_name='render_callouts'),
+    [
+        Output('range-end-balance', 'children'),
+        Output('range-change-in-balance', 'children'),
+        Output('range-transactions', 'children')
+    ],
+    [
+        Input('range-callout-values', 'data'),
+        Input('toggle-dots', 'value')
+    ]
+)
+
+
+################
+## Drill-down ##
+################
+
+@app.callback(
+    [
+        Output('drilldown-year', 'data'),
+        Output('drilldown-table', 'page_current')
+    ],
+    [
+        Input('balance-over-time', 'clickData'),
+        Input('changes-over-time', 'clickData')
+    ]
+)
+
+def select_drilldown_year(balance_click, changes_click):
+
+    ## Whichever chart was clicked last picks the year, starting again from the first page
+    triggered = dash.callback_context.triggered[0]['prop_id'].split('.')[0] if dash.callback_context.triggered else None
+    click = changes_click if triggered == 'changes-over-time' else balance_click
+    if not click:
+        return (dash.no_update, dash.no_update)
+    return (int(click['points'][0]['x']), 0)
+
+@app.callback(
+    Output('drilldown-rows', 'data'),
+    [
+        Input('account-type-dropdown', 'value'),
+        Input('account-name-dropdown', 'value'),
+        Input('budget-dropdown', 'value'),
+        Input('drilldown-year', 'data'),
+        Input('drilldown-table', 'page_current'),
+        Input('drilldown-table', 'page_size'),
+        Input('drilldown-table', 'sort_by'),
+        Input('drilldown-table', 'filter_query'),
+        Input('data-version', 'data')
+    ]
+)
+@cached_callback
+def update_drilldown(account_types, account_names, budget_id, year, page_current, page_size, sort_by, filter_query, data_version):
+
+    ## Ensure account_types is always a list, and default to the latest year until a chart is clicked
+    if isinstance(account_types, str):
+        account_types = [account_types]
+    if year is None:
+        year = int(get_budget(budget_id)['cube_months'].dt.year.max())
+
+    store_path = f'{STORE_DIR}/{budget_id}.sqlite'
+    if not os.path.exists(store_path):
+        return {'title': 'No transaction store for this budget yet.', 'rows': [], 'page_count': 0}
+
+    ## Only the requested page comes back from the store - the filter, sort and count all run in SQL
+    conn = ynab_store.open_store_readonly(store_path)
+    try:
+        account_index = account_groupings.classify_accounts(ynab_store.get_accounts(conn))
+        account_ids = [
+            account_id for account_type in account_types for account_id in account_index.groups.get(account_type, [])
+            if not account_names or account_index.name(account_id) in account_names
+        ]
+        try:
+            rows, total = ynab_store.query_transactions(
+                conn, dict.fromkeys(account_ids), f"{year}-01-01", f"{year}-12-31",
+                filters=parse_filter_query(filter_query),
+                sort_by=[(sort['column_id'], sort['direction']) for sort in sort_by or []],
+                limit=page_size,
+                offset=(page_current or 0) * page_size
+            )
+        except ValueError as error:
+            return {'title': str(error), 'rows': [], 'page_count': 0}
+    finally:
+        conn.close()
 
-    return (formatted_annual_increase, formatted_annual_percentage_increase, formatted_avg_transaction_amount)
+    return {
+        'title': f"{', '.join(account_types)} transactions in {year} ({total:,})",
+        'rows': [
+            {'date': tx_date, 'account_name': account_name, 'payee_name': payee_name, 'category_name': category_name, 'memo': memo, 'amount': "${:,.2f}".format(amount / 1000)}
+            for tx_date, account_name, payee_name, category_name, memo, amount in rows
+        ],
+        'page_count': max(1, -(-total // page_size)),
+    }
+
+## Show the page, with amounts masked in the browser when 'Hide Numbers' is on
+app.clientside_callback(
+    ClientsideFunction(namespace='ynab_wrapped', function_name='render_drilldown'),
+    [
+        Output('drilldown-table', 'data'),
+        Output('drilldown-table', 'page_count'),
+        Output('drilldown-title', 'children')
+    ],
+    [
+        Input('drilldown-rows', 'data'),
+        Input('toggle-dots', 'value')
+    ]
+)
+
+
+####################
+## Year in Review ##
+####################
+
+@app.callback(
+    [
+        Output('wrapped-year-dropdown', 'options'),
+        Output('wrapped-year-dropdown', 'value')
+    ],
+    [
+        Input('budget-dropdown', 'value'),
+        Input('data-version', 'data')
+    ],
+    [State('wrapped-year-dropdown', 'value')]
+)
+
+def update_wrapped_years(budget_id, data_version, year):
+
+    ## Every year the rollups cover, staying on the selected one if it's still there and otherwise showing the latest
+    conn = open_budget_store(budget_id)
+    if conn is None:
+        return ([], None)
+    try:
+        years = sorted(ynab_store.get_rollup_years(conn), reverse=True)
+    finally:
+        conn.close()
+    return ([{'label': str(rollup_year), 'value': rollup_year} for rollup_year in years], year if year in years else (years[0] if years else None))
+
+@app.callback(
+    Output('wrapped-insights', 'data'),
+    [
+        Input('budget-dropdown', 'value'),
+        Input('wrapped-year-dropdown', 'value'),
+        Input('data-version', 'data')
+    ]
+)
+@cached_callback
+def update_wrapped(budget_id, year, data_version):
+    conn = open_budget_store(budget_id) if year is not None else None
+    if conn is None:
+        return None
+
+    ## Everything here is read from the rollup tables, so it's a handful of small queries however long the history is
+    try:
+        top_categories = ynab_store.get_top_spend(conn, 'category', year)[::-1]  ## Biggest at the top of the bar chart
+        top_payees = ynab_store.get_top_spend(conn, 'payee', year)[::-1]
+        monthly_spend = ynab_store.get_monthly_spend(conn, year)
+        previous_monthly_spend = ynab_store.get_monthly_spend(conn, year - 1)
+        category_deltas = ynab_store.get_category_deltas(conn, year)
+        largest_transactions = ynab_store.get_largest_transactions(conn, year)
+    finally:
+        conn.close()
+
+    ## Top Categories and Top Payees
+    figures = {}
+    for key, title, rows in [('top_categories', 'Top Categories', top_categories), ('top_payees', 'Top Payees', top_payees)]:
+        figures[key] = spend_figure(f'{title} in {year}', [
+            go.Bar(
+                x=[spend / 1000 for _, spend, _ in rows],
+                y=[name for name, _, _ in rows],
+                orientation='h',
+                name='Spend',
+                text=[f"${spend / 1000:,.2f} over {count:,} transactions" for _, spend, count in rows],
+                textposition='none',
+                hoverinfo='text'
+            )
+        ], horizontal=True)
+
+    ## Monthly Spend, against the year before
+    month_names = pd.date_range(f'{year}-01-01', periods=12, freq='MS').strftime('%b').tolist()
+    figures['monthly_spend'] = spend_figure(f'Monthly Spend in {year}', [
+        go.Scatter(
+            x=month_names,
+            y=[spend / 1000 for spend in month_spend],
+            mode='lines+markers',
+            name=str(spend_year),
+            text=[f"${spend / 1000:,.2f}" for spend in month_spend],
+            hoverinfo='text'
+        )
+        for spend_year, month_spend in [(year - 1, previous_monthly_spend), (year, monthly_spend)]
+    ])
+
+    ## Categories that moved most since the year before
+    figures['category_deltas'] = spend_figure(f'Biggest Category Changes vs {year - 1}', [
+        go.Bar(
+            x=[name for name, _, _ in category_deltas],
+            y=[(spend - previous_spend) / 1000 for _, spend, previous_spend in category_deltas],
+            name='Change in Spend',
+            text=[f"{'+' if spend >= previous_spend else '-'}${abs(spend - previous_spend) / 1000:,.2f} (${previous_spend / 1000:,.2f} to ${spend / 1000:,.2f})" for _, spend, previous_spend in category_deltas],
+            textposition='none',
+            hoverinfo='text'
+        )
+    ])
+
+    return {
+        'figures': figures,
+        'largest_transactions': [
+            {'date': tx_date, 'account_name': account_name, 'payee_name': payee_name, 'category_name': category_name, 'amount': "${:,.2f}".format(-amount / 1000)}
+            for tx_date, account_name, payee_name, category_name, amount in largest_transactions
+        ],
+    }
+
+## Show the Year in Review, masked in the browser when 'Hide Numbers' is on
+app.clientside_callback(
+    ClientsideFunction(namespace='ynab_wrapped', function_name='render_wrapped'),
+    [
+        Output('top-categories', 'figure'),
+        Output('top-payees', 'figure'),
+        Output('monthly-spend', 'figure'),
+        Output('category-deltas', 'figure'),
+        Output('largest-transactions', 'data')
+    ],
+    [
+        Input('wrapped-insights', 'data'),
+        Input('toggle-dots', 'value')
+    ]
+)
 
 
 if __name__ == '__main__':
+    data_provider.start()
     app.run_server()
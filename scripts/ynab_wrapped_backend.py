@@ -3,140 +3,266 @@
 ###############
 
 ## Import packages
-import requests
 import json
 from datetime import datetime
-import pandas as pd
 from dotenv import load_dotenv
+import importlib
 import os
+import threading
+import account_groupings
+import ynab_api
+import ynab_ingest
+import ynab_store
+from ynab_metrics import metrics
+
+## numpy, pandas and pyarrow take most of a second to import and nothing needs them until the transactions are in, so
+## they're imported in the background while the API calls are being made
+heavy_imports = threading.Thread(target=lambda: [importlib.import_module(name) for name in ('numpy', 'pandas', 'ynab_calculations', 'ynab_outputs')], daemon=True)
+heavy_imports.start()
+
+## Everything lives under one folder - override YNAB_WRAPPED_DIR (and YNAB_BASE_URL) to run somewhere else, e.g. against scripts/mock_ynab_server.py
+YNAB_WRAPPED_DIR = os.getenv('YNAB_WRAPPED_DIR', '/Users/kevinroche22/PythonData/ynab_wrapped')
 
 # Load environment variables from .env file
-load_dotenv(dotenv_path='/Users/kevinroche22/PythonData/ynab_wrapped/.env')
+load_dotenv(dotenv_path=f'{YNAB_WRAPPED_DIR}/.env')
 
 ## Set vars
 API_KEY = os.getenv('API_KEY')
 BUDGET_ID = os.getenv('BUDGET_ID')
-BASE_URL = "https://api.ynab.com/v1"
-
-## Set up the headers for authorization
-headers = {
-    "Authorization": f"Bearer {API_KEY}",
-    "Content-Type": "application/json"
-}
-
-## Get all accounts
-accounts_url = f"{BASE_URL}/budgets/{BUDGET_ID}/accounts"
-response = requests.get(accounts_url, headers=headers)
-all_accounts = response.json()['data']['accounts']
-all_accounts_df = pd.DataFrame(all_accounts)
-
-## Define account subsets
-## String matching is gross but ultimately most appropriate for this use case - revisit in future years to make sure these labels are still applicable.
-registered_account_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('rrsp|tfsa|dpsp|lira')]['id'].unique()
-non_registered_account_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('non-registered')]['id'].unique()
-registered_gains_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('gain')]['id'].unique()
-non_registered_gains_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('non-registered gain')]['id'].unique() ## empty... for now.
-mortgage_account_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('mortgage')]['id'].unique()
-home_value_account_ids = all_accounts_df[all_accounts_df['name'].str.lower().str.contains('house')]['id'].unique()
-
-## Combine all groupings into a dictionary
-account_groupings = {
-    'Registered': registered_account_ids,
-    'Non-Registered': non_registered_account_ids,
-    'Registered Gains': registered_gains_ids,
-    'Non-Registered Gains': non_registered_gains_ids,
-    'Mortgage': mortgage_account_ids,
-    'Home Value': home_value_account_ids,
-}
-
-## Determine the range of years: 2022 to the current year
-current_year = datetime.now().year
-years_range = range(2022, current_year + 1)
+BASE_URL = os.getenv('YNAB_BASE_URL', "https://api.ynab.com/v1")
+
+## Where everything gets written - each budget's outputs go in their own folder so several can sit side by side and
+## the Dash app can switch between them. BUDGET_NAME (set by ynab_wrapped_batch.py) is what the app shows for it.
+OUTPUT_DIR = f'{YNAB_WRAPPED_DIR}/intermediate outputs'
+BUDGET_OUTPUT_DIR = f'{OUTPUT_DIR}/budgets/{BUDGET_ID}'
+BUDGET_NAME = os.getenv('BUDGET_NAME')
+ACCOUNT_BALANCES_DIR = f'{BUDGET_OUTPUT_DIR}/account_balances'
+TRANSACTIONS_DIR = f'{BUDGET_OUTPUT_DIR}/transactions'
+ACCOUNT_MONTHS_PATH = f'{BUDGET_OUTPUT_DIR}/account_months.arrow'
+
+## Local transaction store - one SQLite file per budget. Set FULL_REFRESH=true to throw it away, re-download everything and rewrite every output year.
+STORE_PATH = f'{OUTPUT_DIR}/transaction_store/{BUDGET_ID}.sqlite'
+FULL_REFRESH = os.getenv('FULL_REFRESH', 'false').lower() == 'true'
+
+## How to download transactions - 'bulk' makes one request for the whole budget, 'account' makes one request per account
+## (in parallel, FETCH_WORKERS at a time). SINCE_DATE (YYYY-MM-DD) limits how far back a fresh download goes.
+FETCH_MODE = os.getenv('FETCH_MODE', 'bulk')
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', '8'))
+SINCE_DATE = os.getenv('SINCE_DATE')
+
+## API responses can be cached on disk (see ynab_api.ResponseCache) - HTTP_CACHE=cache reuses responses younger than
+## their endpoint's TTL, record stores every response, and replay runs entirely from recorded responses, never
+## touching the API. Off by default.
+HTTP_CACHE = os.getenv('HTTP_CACHE', 'off')
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', f'{OUTPUT_DIR}/http_cache')
+
+## Metrics - timers and counters for each stage, fetch and write are appended to METRICS_PATH as JSON lines. Set
+## PROMETHEUS_PATH to also get a Prometheus text-format snapshot of the totals at the end of each run.
+METRICS_PATH = os.getenv('METRICS_PATH', f'{OUTPUT_DIR}/metrics/backend_metrics.jsonl')
+PROMETHEUS_PATH = os.getenv('PROMETHEUS_PATH')
+metrics.configure(METRICS_PATH, PROMETHEUS_PATH, budget_id=BUDGET_ID)
 
-## Initialize an empty list to store account balances
-account_balances = []
+## Set up a pooled keep-alive session (carrying the authorization headers) and a rate limiter shared by every worker
+## (and, in a batch run, by every other budget being processed at the same time)
+session = ynab_api.make_session(API_KEY, FETCH_WORKERS)
+rate_limiter = ynab_api.get_rate_limiter()
+if HTTP_CACHE != 'off':
+    ynab_api.use_response_cache(ynab_api.ResponseCache(HTTP_CACHE_DIR, HTTP_CACHE))
+
+## Open the local store, wiping it first if a full refresh was asked for
+store = ynab_store.open_store(STORE_PATH)
+if FULL_REFRESH:
+    ynab_store.reset_store(store)
+
+## Function to build the query parameters asking only for what has changed since the last sync
+def delta_params(server_knowledge, since_date=None):
+    params = {}
+    if server_knowledge is not None:
+        params['last_knowledge_of_server'] = server_knowledge
+    if since_date:
+        params['since_date'] = since_date
+    return params
+
+## Function to request only what has changed on an endpoint since the last sync, returning the changes and the new server_knowledge.
+## The store is only read here, never written, so this is safe to run from the fetch workers.
+def get_delta(endpoint, data_key, server_knowledge):
+    data = ynab_api.get_data(session, rate_limiter, f"{BASE_URL}/budgets/{BUDGET_ID}/{endpoint}", params=delta_params(server_knowledge))
+    return data[data_key], data['server_knowledge']
+
+## Function to request the transactions that changed on an endpoint since the last sync. The response is parsed as it
+## streams in, straight into compact column buffers, so the full JSON body is never held in memory.
+def get_transactions_delta(endpoint, server_knowledge, since_date=None):
+    url = f"{BASE_URL}/budgets/{BUDGET_ID}/{endpoint}"
+    with metrics.timer('transaction_fetch_seconds', endpoint=ynab_api.endpoint_label(url)):
+        with ynab_api.get_response(session, rate_limiter, url, params=delta_params(server_knowledge, since_date), stream=True) as response:
+            return ynab_ingest.read_transactions(response, ynab_api.endpoint_label(url))
+
+## Get all accounts - sync any changes into the store, then read the full list back out of it
+with metrics.timer('accounts_fetch_seconds'):
+    accounts_delta, server_knowledge = get_delta("accounts", "accounts", ynab_store.get_server_knowledge(store, "accounts"))
+ynab_store.merge_accounts(store, "accounts", accounts_delta, server_knowledge)
+all_accounts = ynab_store.get_accounts(store)
+
+## Sort accounts into groups using the rules in account_groupings.json, flagging any that land in unexpected places
+account_index = account_groupings.classify_accounts(all_accounts)
+account_index.report()
+account_groups = account_index.groups
+
+## Determine the range of years: the year we started the budget (2022, unless FIRST_YEAR says otherwise) to the current year
+current_year = datetime.now().year
+years_range = range(int(os.getenv('FIRST_YEAR', '2022')), current_year + 1)
 
 
 ######################
 ## Define Functions ##
 ######################
 
-## Function to get transactions for an account after a given start date
-def get_transactions(account_id):
-    response = requests.get(f"{BASE_URL}/budgets/{BUDGET_ID}/accounts/{account_id}/transactions", headers=headers)
-    response.raise_for_status()  ## Raise error for bad status codes
-    return response.json()["data"]["transactions"]
+## Function to sync the transactions for the whole budget in a single request - whatever changed since the last sync
+## comes back for every account at once, and the store keeps each transaction against its account_id
+def sync_budget_transactions():
+    server_knowledge = ynab_store.get_server_knowledge(store, "transactions")
+    transactions_delta, server_knowledge = get_transactions_delta("transactions", server_knowledge, SINCE_DATE)
+    ynab_store.merge_transactions(store, "transactions", transactions_delta, server_knowledge)
+    print(f"Synced {len(transactions_delta)} changed transactions, {rate_limiter.remaining()} requests left in this hour's budget.")
 
-## Function to manually filter transactions within a date range
-def filter_transactions_by_date(transactions, start_date, end_date):
-    start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    end_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    filtered_transactions = [
-        tx for tx in transactions
-        if start_dt <= datetime.strptime(tx['date'], "%Y-%m-%d") <= end_dt
-    ]
-    return filtered_transactions
+## Function to sync the transactions for a set of accounts - downloads whatever changed since the last sync (new, updated and
+## deleted transactions) for every account in parallel, merging each into the local store as it arrives
+def sync_transactions(account_ids):
+    endpoints = {account_id: f"accounts/{account_id}/transactions" for account_id in account_ids}
+    known = {account_id: ynab_store.get_server_knowledge(store, endpoint) for account_id, endpoint in endpoints.items()}
+    fetch = lambda account_id: get_transactions_delta(endpoints[account_id], known[account_id], SINCE_DATE)
+    for account_id, (transactions_delta, server_knowledge) in ynab_api.fetch_all(fetch, account_ids, FETCH_WORKERS):
+        ynab_store.merge_transactions(store, endpoints[account_id], transactions_delta, server_knowledge)
+    print(f"Synced {len(account_ids)} accounts, {rate_limiter.remaining()} requests left in this hour's budget.")
 
 
 ##################
 ## Calculations ##
 ##################
 
-## Loop through each account group
-for group_name, account_ids in account_groupings.items():
+## Download every account we need up front - each account once, even if it sits in more than one group. Fetching account
+## by account, the on-budget accounts come down too: the grouped accounts are tracking accounts with no categories, and
+## the Year in Review's spend is categorized outflows, which only the on-budget accounts have.
+account_ids_needed = account_index.grouped_account_ids()
+if FETCH_MODE == 'bulk':
+    sync_budget_transactions()
+else:
+    grouped_account_ids = set(account_ids_needed)
+    spend_account_ids = [account['id'] for account in all_accounts if account.get('on_budget') and account['id'] not in grouped_account_ids]
+    sync_transactions(account_ids_needed + spend_account_ids)
 
-    ## Print group name
-    print(f"Currently looking at {group_name}.")
+metrics.end_stage('fetch')
+
+## Everything from here on needs the heavy imports started at the top - usually done by now
+heavy_imports.join()
+import numpy as np
+import ynab_calculations
+import ynab_outputs
 
-    ## Skip groups that have no account IDs
+## Print what we're working with, group by group
+for group_name, account_ids in account_groups.items():
+    print(f"Currently looking at {group_name}.")
     if len(account_ids) == 0:
         print(f"Skipping {group_name} as it has no accounts.")
-        continue  ## Skip to the next grouping if no accounts are in this one
-
-    ## Loop through accounts within grouping 
-    for account_id in account_ids:
-
-        ## Fetch the account details from the YNAB API
-        account = next(acc for acc in all_accounts if acc['id'] == account_id)
-
-        ## Get all transactions for the account
-        transactions = get_transactions(account_id)
-        
-        ## Loop through the years from the first year we had the budget to the current year
-        for year in years_range:
-
-            ## Print year
-            print(f"Making calculations for {account['name']} in {year}.")
-            
-            ## Define the start and end date. Budget was started in 2022, so this loops through each year and calculates using all transactions from 2022 to the year in question.
-            start_date = "2022-01-01"
-            end_date = f"{year}-12-31"
-            transactions_over_timeframe = filter_transactions_by_date(transactions, start_date, end_date)
-            
-            ## Calculate the balance for the end of the year (sum of filtered transactions)
-            balance_end_of_year = sum(tx['amount'] for tx in transactions_over_timeframe) / 1000
-            number_of_transactions = len(transactions_over_timeframe)
-            
-            ## Store the balances along with the account, group, and year info
-            account_balances.append({
-                'account_type': group_name,
-                'account_name': account['name'],
-                'year': year,
-                'number_of_transactions_in_timeframe': number_of_transactions,
-                'end_of_year_balance': balance_end_of_year
-            })
-
-## Convert the results to a DataFrame for better readability
-df_account_balances = pd.DataFrame(account_balances)
-
-## Calculate the actual number of transactions and balance changes
-df_account_balances['number_of_transactions'] = df_account_balances.groupby('account_name')['number_of_transactions_in_timeframe'].diff().fillna(df_account_balances['number_of_transactions_in_timeframe']).astype(int)
-df_account_balances = df_account_balances.drop(columns=['number_of_transactions_in_timeframe'])
-df_account_balances['change_in_balance'] = df_account_balances.groupby('account_name')['end_of_year_balance'].diff().fillna(0)
 
+## Give every account we need a small integer code
+account_codes_by_id = {account_id: code for code, account_id in enumerate(account_ids_needed)}
+account_names = [account_index.name(account_id) for account_id in account_ids_needed]
 
-##################
-## Write to csv ##
-##################
+## Work out which (account, year) checkpoints need recomputing - the open year always does, as does any year a merge has
+## touched since the last run, and any year we've never checkpointed. Closed years nobody has edited are left alone.
+dirty_years = ynab_store.get_dirty_years(store)
+checkpoint_hashes = ynab_store.get_year_checkpoint_hashes(store)
+stale_checkpoints = [
+    (account_id, year) for account_id in account_ids_needed for year in years_range
+    if FULL_REFRESH or year == current_year or (account_id, year) in dirty_years or (account_id, year) not in checkpoint_hashes
+]
+
+## Recompute just those in one pass - one scan for the stale years' transactions, one bincount into (account, month)
+## buckets and a hash per (account, year) - and only keep a result if its transactions actually changed (e.g. editing a
+## memo dirties a year without changing its numbers). Every changed checkpoint is saved in one transaction.
+print(f"Making calculations for {len(stale_checkpoints)} of {len(account_ids_needed) * len(years_range)} account-years.")
+with metrics.timer('year_calculation_seconds'):
+    stale_account_ids, stale_dates, stale_amounts, stale_ids = ynab_calculations.transaction_columns(
+        ynab_store.get_year_transactions(store, {year for _, year in stale_checkpoints})
+    )
+    stale_codes = np.fromiter((account_codes_by_id.get(account_id, -1) for account_id in stale_account_ids), dtype=np.int64, count=len(stale_account_ids))
+    needed = stale_codes >= 0  ## Transactions in accounts that aren't in any group are left out
+    stale_net_flow, stale_counts = ynab_calculations.month_buckets(stale_codes[needed], stale_dates[needed], stale_amounts[needed], len(account_ids_needed), years_range)
+    stale_hashes = ynab_calculations.year_content_hashes(stale_codes[needed], stale_dates[needed], stale_amounts[needed], stale_ids[needed])
+    changed_checkpoints = []
+    for account_id, year in stale_checkpoints:
+        code, first_month = account_codes_by_id[account_id], (year - years_range[0]) * 12
+        year_hash = stale_hashes.get((code, year), ynab_calculations.EMPTY_YEAR_HASH)
+        if checkpoint_hashes.get((account_id, year)) != year_hash:
+            changed_checkpoints.append((account_id, year, year_hash, stale_net_flow[code, first_month:first_month + 12], stale_counts[code, first_month:first_month + 12]))
+    ynab_store.save_year_checkpoints(store, changed_checkpoints)
+    del stale_account_ids, stale_dates, stale_amounts, stale_ids, stale_codes, needed  ## Don't hold every stale row through the write stage
+metrics.increment('account_years_recomputed_total', len(stale_checkpoints))
+metrics.increment('account_years_changed_total', len(changed_checkpoints))
+print(f"{len(changed_checkpoints)} account-years changed: {sorted(set(checkpoint[1] for checkpoint in changed_checkpoints))}.")
+
+## Lay the monthly checkpoints out as an (account, month) grid. Everything counts from January 1st of the first year.
+month_net_flow = np.zeros((len(account_ids_needed), len(years_range) * 12), dtype=np.int64)
+month_counts = np.zeros((len(account_ids_needed), len(years_range) * 12), dtype=np.int64)
+for account_id, year, month, net_flow, number_of_transactions in ynab_store.get_month_checkpoints(store, account_ids_needed, years_range):
+    cell = (year - years_range[0]) * 12 + month - 1
+    month_net_flow[account_codes_by_id[account_id], cell] = net_flow
+    month_counts[account_codes_by_id[account_id], cell] = number_of_transactions
+
+## Roll the months up into end of year balances, transaction counts and changes in balance, and lay the results out one
+## row per account group, account and year (and per month for the cube)
+with metrics.timer('rollup_seconds'):
+    balances, counts, changes = ynab_calculations.year_end_from_buckets(*ynab_calculations.roll_up_years(month_net_flow, month_counts))
+    df_account_balances = ynab_calculations.build_account_balances(account_groups, account_codes_by_id, account_names, balances, counts, changes, years_range)
+    df_account_months = ynab_calculations.build_account_months(account_groups, account_codes_by_id, account_names, month_net_flow, month_counts, years_range)
+
+## Wrapped rollups (spend by category and payee, largest transactions) - only the years a merge touched, plus any never built
+rollup_years = set(years_range) if FULL_REFRESH else {year for _, year in dirty_years if year in years_range} | (set(years_range) - ynab_store.get_rollup_years(store))
+with metrics.timer('rollup_refresh_seconds'):
+    ynab_store.refresh_rollups(store, rollup_years)
+print(f"Refreshed Wrapped rollups for {sorted(rollup_years)}.")
+
+metrics.end_stage('compute')
+
+
+###################
+## Write outputs ##
+###################
+
+## Which budget this folder is for
+ynab_outputs.write_budget_info(BUDGET_OUTPUT_DIR, BUDGET_ID, BUDGET_NAME)
+
+## Account balances - one file per year. Past years are only rewritten when their numbers change (a backdated edit moves
+## every balance from that year on) or on a full refresh.
+with metrics.timer('output_write_seconds', output='account_balances'):
+    years_written = ynab_outputs.write_account_balances(df_account_balances, ACCOUNT_BALANCES_DIR, current_year, rewrite=FULL_REFRESH)
+print(f"Wrote account balances for {years_written}.")
+
+## Account x month cube, with running totals, for arbitrary date ranges in the app
+with metrics.timer('output_write_seconds', output='account_months'):
+    ynab_outputs.write_account_months(df_account_months, ACCOUNT_MONTHS_PATH)
+
+## Per-transaction detail - same layout, amounts kept as integer milliunits. Only the open year, years a merge touched and
+## years that have never been written are exported (every year on a full refresh), one year at a time straight from the
+## store, so only one year's transactions are ever held in memory. Years with no transactions left (every one of them
+## deleted) have their files removed.
+transaction_years = ynab_store.get_transaction_years(store)
+detail_years = transaction_years if FULL_REFRESH else {year for _, year in dirty_years} | {current_year} | (set(years_range) - set(ynab_outputs.written_years(TRANSACTIONS_DIR)))
+years_written = []
+with metrics.timer('output_write_seconds', output='transactions'):
+    for year in sorted(detail_years & transaction_years):
+        detail_ids, detail_account_ids, detail_dates, detail_amounts = ynab_store.get_year_transaction_columns(store, year)
+        detail_account_names = [account_index.name(account_id) if account_id in account_index.accounts_by_id else '' for account_id in detail_account_ids]
+        ynab_outputs.write_transactions_year(TRANSACTIONS_DIR, year, detail_ids, detail_account_ids, detail_account_names, detail_dates, detail_amounts)
+        years_written.append(year)
+    years_removed = sorted(set(ynab_outputs.written_years(TRANSACTIONS_DIR)) - transaction_years)
+    for year in years_removed:
+        ynab_outputs.remove_year(TRANSACTIONS_DIR, year)
+print(f"Wrote transactions for {years_written}" + (f", removed {years_removed}." if years_removed else "."))
 
-df_account_balances.to_csv('/Users/kevinroche22/PythonData/ynab_wrapped/intermediate outputs/account_balances.csv', index=False)
\ No newline at end of file
+## Everything downstream of the dirty marks is written, so clear them and we're done with the store
+ynab_store.clear_dirty_years(store)
+store.close()
+metrics.end_stage('write')
+metrics.write_prometheus()
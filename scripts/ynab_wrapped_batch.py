@@ -0,0 +1,111 @@
+###############
+## Batch Run ##
+###############
+
+## Runs the backend for several budgets at once, each in its own process. The budgets can be given on the command line
+## or as a comma-separated BUDGET_IDS in the .env file; with neither, every budget the API key can see is discovered
+## through /budgets. All the processes share one rate limiter (hosted by a multiprocessing manager), since YNAB's 200
+## requests an hour are per access token, not per budget. Each budget's outputs land in their own folder under
+## 'intermediate outputs/budgets', and the Dash app can switch between them.
+## Run with: python scripts/ynab_wrapped_batch.py [budget_id ...]
+
+## Import packages
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+from dotenv import load_dotenv
+import argparse
+import os
+import runpy
+import sys
+import time
+import ynab_api
+
+## Everything lives under one folder, same as the backend
+YNAB_WRAPPED_DIR = os.getenv('YNAB_WRAPPED_DIR', '/Users/kevinroche22/PythonData/ynab_wrapped')
+
+# Load environment variables from .env file
+load_dotenv(dotenv_path=f'{YNAB_WRAPPED_DIR}/.env')
+
+## Set vars
+API_KEY = os.getenv('API_KEY')
+BASE_URL = os.getenv('YNAB_BASE_URL', "https://api.ynab.com/v1")
+BUDGET_IDS = [budget_id.strip() for budget_id in os.getenv('BUDGET_IDS', '').split(',') if budget_id.strip()]
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+BACKEND_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ynab_wrapped_backend.py')
+
+## Same response cache as the backend (see ynab_wrapped_backend.py), so budget discovery can be replayed too
+HTTP_CACHE = os.getenv('HTTP_CACHE', 'off')
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', f'{YNAB_WRAPPED_DIR}/intermediate outputs/http_cache')
+
+
+######################
+## Define Functions ##
+######################
+
+## Manager process holding the one rate limiter every budget's process talks to
+class RateLimiterManager(BaseManager):
+    pass
+
+RateLimiterManager.register('RateLimiter', ynab_api.RateLimiter, exposed=('acquire', 'update', 'remaining'))
+
+## Function to list every budget the API key can see, as {budget_id: name}
+def discover_budgets(session, limiter):
+    data = ynab_api.get_data(session, limiter, f"{BASE_URL}/budgets")
+    return {budget['id']: budget['name'] for budget in data['budgets']}
+
+## Function to run the backend for one budget in this process, returning how long it took and any error
+def run_budget(budget_id, budget_name):
+    os.environ['BUDGET_ID'] = budget_id
+    os.environ['BUDGET_NAME'] = budget_name
+    started = time.perf_counter()
+    try:
+        runpy.run_path(BACKEND_PATH, run_name='__main__')
+    except (Exception, SystemExit) as error:
+        return budget_id, time.perf_counter() - started, f"{type(error).__name__}: {error}"
+    return budget_id, time.perf_counter() - started, None
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the backend for several budgets in parallel.')
+    parser.add_argument('budget_ids', nargs='*', help='budgets to process (default BUDGET_IDS, or every budget found through /budgets)')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help='budgets processed at the same time')
+    args = parser.parse_args()
+
+    ## Start the shared rate limiter
+    manager = RateLimiterManager()
+    manager.start()
+    rate_limiter = manager.RateLimiter()
+
+    ## Work out which budgets to process - names come from /budgets, so ask for them even when the ids are given
+    if HTTP_CACHE != 'off':
+        ynab_api.use_response_cache(ynab_api.ResponseCache(HTTP_CACHE_DIR, HTTP_CACHE))
+    session = ynab_api.make_session(API_KEY, 1)
+    available = discover_budgets(session, rate_limiter)
+    budget_ids = args.budget_ids or BUDGET_IDS or list(available)
+    if not budget_ids:
+        sys.exit("No budgets found for this API key.")
+    unknown = [budget_id for budget_id in budget_ids if budget_id not in available]
+    if unknown:
+        sys.exit(f"Budgets not found for this API key: {', '.join(unknown)}.")
+    print(f"Processing {len(budget_ids)} budgets, {min(args.workers, len(budget_ids))} at a time: {', '.join(available[budget_id] for budget_id in budget_ids)}.")
+
+    ## Run each budget's backend in the process pool, every process using the shared rate limiter
+    failed = []
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(budget_ids)), initializer=ynab_api.use_shared_rate_limiter, initargs=(rate_limiter,)) as executor:
+        futures = [executor.submit(run_budget, budget_id, available[budget_id]) for budget_id in budget_ids]
+        for future in as_completed(futures):
+            budget_id, seconds, error = future.result()
+            if error:
+                failed.append(budget_id)
+                print(f"{available[budget_id]} failed after {seconds:.1f}s - {error}")
+            else:
+                print(f"{available[budget_id]} done in {seconds:.1f}s.")
+
+    print(f"Finished with {rate_limiter.remaining()} requests left in this hour's budget.")
+    manager.shutdown()
+    if failed:
+        sys.exit(f"{len(failed)} of {len(budget_ids)} budgets failed.")
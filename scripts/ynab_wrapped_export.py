@@ -0,0 +1,99 @@
+############
+## Export ##
+############
+
+## Exports the Balance Over Time and Changes in Balance Over Time views as a static site that needs no Python to view -
+## host the folder on any static file storage, or open index.html straight from disk. Every budget's per-account,
+## per-year series go into data.js in a compact columnar form, and the page (static_report/ynab_wrapped_static.js)
+## does what the app's callbacks do: filters accounts by type and name, sums them by year and builds the charts, with
+## Hide Numbers masked the same way the app masks it (assets/ynab_wrapped.js). plotly.js is bundled alongside.
+## Run with: python scripts/ynab_wrapped_export.py [--output folder] [budget_id ...]
+
+## Import packages
+from datetime import datetime
+import argparse
+import json
+import os
+import shutil
+import sys
+from plotly.offline import get_plotlyjs
+import ynab_data
+import ynab_outputs
+
+## Where the backend wrote its outputs, and where the export goes by default
+OUTPUT_DIR = f"{os.getenv('YNAB_WRAPPED_DIR', '/Users/kevinroche22/PythonData/ynab_wrapped')}/intermediate outputs"
+BUDGETS_DIR = f'{OUTPUT_DIR}/budgets'
+EXPORT_DIR = os.getenv('EXPORT_DIR', f"{os.getenv('YNAB_WRAPPED_DIR', '/Users/kevinroche22/PythonData/ynab_wrapped')}/static report")
+
+## The page itself, and the masking shared with the app
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE_FILES = [
+    os.path.join(SCRIPTS_DIR, 'static_report', 'index.html'),
+    os.path.join(SCRIPTS_DIR, 'static_report', 'ynab_wrapped_static.js'),
+    os.path.join(SCRIPTS_DIR, 'assets', 'ynab_wrapped.js'),
+]
+
+
+######################
+## Define Functions ##
+######################
+
+## Function to lay one budget's account balances out as one series per (account_type, account_name), each a list of
+## per-year values. The app's AccountBalances table already holds them that way - account types as indexes into
+## account_types, series in the order the app lists account names in, and dollar amounts as integer milliunits so the
+## browser can sum them exactly.
+def export_budget(budget_id, budget_name, budget):
+    account_balances = budget['account_balances']
+    return {
+        'id': budget_id,
+        'name': budget_name,
+        'years': account_balances.years.tolist(),
+        'first_year': int(account_balances.years.min()) if len(account_balances.years) else None,  ## Left out of the changes chart
+        'account_types': account_balances.type_names,
+        'type': account_balances.series_types.tolist(),
+        'account_name': [account_balances.account_names[code] for code in account_balances.series_names.tolist()],
+        'balance': account_balances.balances.tolist(),
+        'transactions': account_balances.transactions.tolist(),
+        'change': account_balances.changes.tolist(),
+    }
+
+## Function to write the static site - the page, plotly.js, and every budget's series as data.js (a script rather than
+## a JSON file, so the page also works opened straight from disk)
+def write_export(export_dir, budgets):
+    os.makedirs(export_dir, exist_ok=True)
+    for path in PAGE_FILES:
+        shutil.copyfile(path, os.path.join(export_dir, os.path.basename(path)))
+    with open(os.path.join(export_dir, 'plotly.min.js'), 'w') as f:
+        f.write(get_plotlyjs())
+    payload = {'generated': datetime.now().isoformat(timespec='seconds'), 'budgets': budgets}
+    with open(os.path.join(export_dir, 'data.js.tmp'), 'w') as f:
+        f.write('window.YNAB_WRAPPED_DATA = ')
+        json.dump(payload, f, separators=(',', ':'))
+        f.write(';\n')
+    os.replace(os.path.join(export_dir, 'data.js.tmp'), os.path.join(export_dir, 'data.js'))
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the year-end charts as a static site.')
+    parser.add_argument('budget_ids', nargs='*', help='budgets to export (default every budget with outputs)')
+    parser.add_argument('--output', default=EXPORT_DIR, help='folder to write the site to')
+    args = parser.parse_args()
+
+    ## Work out which budgets to export, starting on BUDGET_ID like the app does
+    budget_names = ynab_outputs.list_budgets(BUDGETS_DIR)
+    budget_ids = args.budget_ids or list(budget_names)
+    unknown = [budget_id for budget_id in budget_ids if budget_id not in budget_names]
+    if unknown:
+        sys.exit(f"No outputs found for budgets: {', '.join(unknown)}.")
+    if os.getenv('BUDGET_ID') in budget_ids:
+        budget_ids.remove(os.getenv('BUDGET_ID'))
+        budget_ids.insert(0, os.getenv('BUDGET_ID'))
+
+    ## Export each budget's series and write the site
+    budgets = [export_budget(budget_id, budget_names[budget_id], ynab_data.load_budget(f'{BUDGETS_DIR}/{budget_id}')) for budget_id in budget_ids]
+    write_export(args.output, budgets)
+    print(f"Exported {len(budgets)} budgets to {args.output} ({os.path.getsize(os.path.join(args.output, 'data.js')) / 1e3:,.0f} KB of data).")
@@ -0,0 +1,61 @@
+############
+## Server ##
+############
+
+## Serves the Dash app in production with gunicorn - several worker processes behind one port instead of Dash's
+## single-process development server. The app (and every budget's data) is loaded once before the workers are forked,
+## so they share it copy-on-write, and the month cubes are memory-mapped so even reloaded data is shared through the
+## page cache. Each worker then watches for new outputs itself. Callback results are cached on disk (CALLBACK_CACHE_DIR)
+## so a figure one worker has built is served by the others, and responses are gzipped when flask-compress is installed.
+## Needs gunicorn (and optionally flask-compress): pip install gunicorn flask-compress
+## Run with: python scripts/ynab_wrapped_server.py
+
+## Import packages
+from gunicorn.app.base import BaseApplication
+import multiprocessing
+import os
+import ynab_wrapped
+
+## Set vars
+SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:8050')
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(min(multiprocessing.cpu_count(), 4))))
+
+## The Flask server behind the Dash app, for running under any other WSGI server
+server = ynab_wrapped.app.server
+
+
+######################
+## Define Functions ##
+######################
+
+## Function run in each worker once it's forked - the data provider's watch thread doesn't survive the fork
+def post_fork(arbiter, worker):
+    ynab_wrapped.data_provider.start()
+
+## Gunicorn application serving the already-loaded app
+class WrappedApplication(BaseApplication):
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return server
+
+
+#########
+## Run ##
+#########
+
+if __name__ == '__main__':
+    print(f"Serving {len(ynab_wrapped.data_provider.snapshot.budgets)} budgets on {SERVER_BIND} with {SERVER_WORKERS} workers.")
+    WrappedApplication({
+        'bind': SERVER_BIND,
+        'workers': SERVER_WORKERS,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()